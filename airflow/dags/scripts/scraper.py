@@ -1,12 +1,20 @@
+import hashlib
+import json
+import os
+import threading
 import requests
 from bs4 import BeautifulSoup
-import time
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
 from aws_s3 import save_image, download_pdf
 from selenium import webdriver
+from selenium.common.exceptions import StaleElementReferenceException, TimeoutException, WebDriverException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.service import Service as ChromeService
 from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.support.ui import WebDriverWait
 
 # Base URL for the first page
 base_url = "https://rpc.cfainstitute.org/en/research-foundation/publications"
@@ -17,42 +25,103 @@ base_domain = "https://rpc.cfainstitute.org"
 # Default alternative image URL
 alternative_image_url = "https://media.istockphoto.com/id/1352945762/vector/no-image-available-like-missing-picture.jpg?s=612x612&w=0&k=20&c=4X-znbt02a8EIdxwDFaxfmKvUhTnLvLMv1i1f3bToog="
 
-# Initialize the Selenium WebDriver
+# Number of listing pages to scrape
+SCRAPER_TOTAL_PAGES = int(os.getenv("SCRAPER_TOTAL_PAGES", "10"))
+# Publication pages, PDFs and images fetched in parallel over plain HTTP
+SCRAPER_DETAIL_WORKERS = int(os.getenv("SCRAPER_DETAIL_WORKERS", "8"))
+# Longest time to wait for the listing results to render before giving up on a page
+SCRAPER_WAIT_SECONDS = int(os.getenv("SCRAPER_WAIT_SECONDS", "30"))
+SCRAPER_HTTP_TIMEOUT = int(os.getenv("SCRAPER_HTTP_TIMEOUT", "60"))
+# Finished listing pages are recorded here so a retried task resumes where it stopped
+SCRAPER_CHECKPOINT_DIR = os.getenv(
+    "SCRAPER_CHECKPOINT_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "checkpoints")
+)
+
+COLUMNS = ["ID", "Title", "Summary", "Image Path", "PDF Path"]
+# Query parameters that only track where a click came from and never select a different page
+TRACKING_PARAMS = {"gclid", "fbclid", "msclkid", "mc_cid", "mc_eid"}
+RESULT_LINK_SELECTOR = "div.CoveoResult h4.coveo-title a.CoveoResultLink"
+
+# Selenium options for the remote browser sessions
 chrome_options = Options()
 chrome_options.add_argument("--headless")
+# Explicit waits decide when a page is ready, so don't block on every subresource
+chrome_options.page_load_strategy = "eager"
 # chrome_options.add_argument("--no-sandbox")
 # chrome_options.add_argument("--disable-dev-shm-usage")
 
-# Connect to the remote Selenium server
-driver = webdriver.Remote(
-    command_executor='http://selenium-chrome:4444/wd/hub',
-    options=chrome_options
-)
+# Browser sessions are opened on first use (not when the DAG file is parsed) and closed by close_driver
+_drivers = {}
+_drivers_lock = threading.Lock()
+_detail_driver_lock = threading.Lock()
 
-# Define a global ID counter outside the functions
-global_id_counter = 1
+# Keep-alive HTTP session shared by the detail fetch workers
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(pool_maxsize=SCRAPER_DETAIL_WORKERS))
 
-def get_publications_from_page(page_url):
-    global global_id_counter  # Declare as global to update across function calls
 
-    # List to store publication data
-    publications_data = []
-    # Load the page using Selenium
+def get_driver(name="listing"):
+    with _drivers_lock:
+        if name not in _drivers:
+            # Connect to the remote Selenium server
+            _drivers[name] = webdriver.Remote(
+                command_executor='http://selenium-chrome:4444/wd/hub',
+                options=chrome_options
+            )
+        return _drivers[name]
+
+
+def canonical_url(link):
+    """
+    Absolute publication URL used to derive its ID: the scheme and host are lowercased and the
+    fragment, tracking parameters and trailing slash removed. The path and remaining query are
+    kept as they are, since they may be case-sensitive.
+    """
+    parts = urlsplit(urljoin(base_domain, link))
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+             if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMS]
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip("/"), urlencode(query), ""))
+
+
+def publication_id(url):
+    """
+    Stable publication ID: the first 60 bits of the SHA-256 of the canonical URL, so the same
+    publication gets the same ID on every run regardless of scrape order.
+    """
+    return int(hashlib.sha256(url.encode("utf-8")).hexdigest()[:15], 16)
+
+
+def load_listing_page(page_url, previous_first_link=None):
+    """
+    Loads a listing page and waits until its results have rendered. The listing pages only differ
+    by their URL fragment, so the results count as loaded once the first link has changed.
+    """
+    driver = get_driver()
     driver.get(page_url)
-    time.sleep(5)  # Wait for the page to fully load
 
-    # Get the page content and pass it to BeautifulSoup
-    soup = BeautifulSoup(driver.page_source, 'html.parser')
-    publications = soup.find_all('div', class_='coveo-list-layout CoveoResult')
+    def results_loaded(d):
+        links = d.find_elements(By.CSS_SELECTOR, RESULT_LINK_SELECTOR)
+        if links and links[0].get_attribute("href") != previous_first_link:
+            return links[0].get_attribute("href")
+        return False
+
+    first_link = WebDriverWait(
+        driver, SCRAPER_WAIT_SECONDS, ignored_exceptions=(StaleElementReferenceException,)
+    ).until(results_loaded)
+    return BeautifulSoup(driver.page_source, 'html.parser'), first_link
+
 
+def parse_listing(soup):
+    listings = []
+    publications = soup.find_all('div', class_='coveo-list-layout CoveoResult')
     for publication in publications:
         # Get the title and link
         title_tag = publication.find('h4', class_='coveo-title').find('a', class_='CoveoResultLink')
         if title_tag:
             title = title_tag.text.strip()
-            publication_link = title_tag['href']
+            publication_link = urljoin(base_domain, title_tag['href'])
         else:
-            print(f"No title available for publication: {len(publications_data)+1}")
+            print(f"No title available for publication: {len(listings)+1}")
             continue
 
         # Extract the summary text
@@ -61,58 +130,186 @@ def get_publications_from_page(page_url):
 
         # Extract the image URL
         result_link_div = publication.find('div', class_='result-link')
-        if result_link_div:
-            image_tag = result_link_div.find('img', class_='coveo-result-image')
-            image_url = base_domain + image_tag['src'] if image_tag else alternative_image_url
-            image_path = save_image(title, image_url)
-        else:
-            image_url = alternative_image_url
-            image_path = save_image(title, image_url)
-
-        # Visit the publication page to extract the PDF link
-        driver.get(publication_link)
-        time.sleep(3)
-        publication_soup = BeautifulSoup(driver.page_source, 'html.parser')
-        pdf_link_tag = publication_soup.find('a', href=lambda href: href and href.endswith('.pdf'))
-        pdf_url = base_domain + pdf_link_tag['href'] if pdf_link_tag else "No PDF found"
-        pdf_path = download_pdf(title, pdf_url)
-
-        # Append data to publications_data
-        publications_data.append({
-            "ID": global_id_counter,
+        image_tag = result_link_div.find('img', class_='coveo-result-image') if result_link_div else None
+        image_url = base_domain + image_tag['src'] if image_tag else alternative_image_url
+
+        listings.append({
+            "ID": publication_id(canonical_url(publication_link)),
             "Title": title,
             "Summary": summary,
-            "Image Path": image_path,
-            "PDF Path": pdf_path
+            "Publication Link": publication_link,
+            "Image URL": image_url
         })
+    return listings
+
+
+def find_pdf_link(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    pdf_link_tag = soup.find('a', href=lambda href: href and href.endswith('.pdf'))
+    return base_domain + pdf_link_tag['href'] if pdf_link_tag else None
+
+
+def get_pdf_url(publication_link):
+    """
+    Finds the PDF link on a publication page. The page is fetched over plain HTTP; only pages
+    whose link is rendered by JavaScript fall back to a (single, shared) browser session.
+    """
+    try:
+        response = http_session.get(publication_link, timeout=SCRAPER_HTTP_TIMEOUT)
+        response.raise_for_status()
+        pdf_url = find_pdf_link(response.text)
+        if pdf_url:
+            return pdf_url
+    except requests.RequestException as e:
+        print(f"Failed to fetch {publication_link} over HTTP. Error: {e}")
+
+    with _detail_driver_lock:
+        try:
+            driver = get_driver("detail")
+            driver.get(publication_link)
+            WebDriverWait(driver, SCRAPER_WAIT_SECONDS).until(
+                lambda d: d.find_elements(By.CSS_SELECTOR, "a[href$='.pdf']")
+            )
+            return find_pdf_link(driver.page_source) or "No PDF found"
+        except TimeoutException:
+            return "No PDF found"
+        except WebDriverException as e:
+            print(f"Failed to load {publication_link} in the browser. Error: {e}")
+            return "No PDF found"
+
+
+def scrape_publication(listing):
+    """
+    Fetches one publication's PDF link and copies its image and PDF to S3.
+    """
+    image_path = save_image(listing["ID"], listing["Title"], listing["Image URL"])
+    pdf_path = download_pdf(listing["ID"], listing["Title"], get_pdf_url(listing["Publication Link"]))
+    return {
+        "ID": listing["ID"],
+        "Title": listing["Title"],
+        "Summary": listing["Summary"],
+        "Image Path": image_path,
+        "PDF Path": pdf_path,
+        "Publication Link": listing["Publication Link"]
+    }
+
+
+def checkpoint_path(run_id):
+    return os.path.join(SCRAPER_CHECKPOINT_DIR, f"{run_id}.jsonl")
+
+
+def load_checkpoint(run_id):
+    """
+    Returns {page_number: [publication, ...]} for the listing pages a previous attempt finished.
+    """
+    pages = {}
+    if not run_id or not os.path.exists(checkpoint_path(run_id)):
+        return pages
+    with open(checkpoint_path(run_id)) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # The last line may be cut short if the previous attempt was killed mid-write
+                continue
+            pages[entry["page"]] = entry["publications"]
+    return pages
+
+
+def save_checkpoint(run_id, page_number, publications):
+    if not run_id:
+        return
+    os.makedirs(SCRAPER_CHECKPOINT_DIR, exist_ok=True)
+    with open(checkpoint_path(run_id), "a") as f:
+        f.write(json.dumps({"page": page_number, "publications": publications}) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def clear_checkpoint(run_id):
+    if run_id and os.path.exists(checkpoint_path(run_id)):
+        os.remove(checkpoint_path(run_id))
+
+
+def finish_page(run_id, page_number, futures):
+    publications_data = []
+    for future in futures:
+        publication = future.result()
 
         # Output the extracted information
-        print(f"ID:{global_id_counter}")
-        print(f"Title: {title}")
-        print(f"Summary: {summary}")
-        print(f"Image Path: {image_path}")
-        print(f"Publication Link: {publication_link}")
-        print(f"PDF Path: {pdf_path}")
+        print(f"ID:{publication['ID']}")
+        print(f"Title: {publication['Title']}")
+        print(f"Summary: {publication['Summary']}")
+        print(f"Image Path: {publication['Image Path']}")
+        print(f"Publication Link: {publication.pop('Publication Link')}")
+        print(f"PDF Path: {publication['PDF Path']}")
         print("-" * 100)
-        global_id_counter += 1  # Increment the global ID counter
-    # Convert the publications_data list to a DataFrame
-    publications_df = pd.DataFrame(publications_data, columns=["ID", "Title", "Summary", "Image Path", "PDF Path"])
-    return publications_df
-
-def scrape_publications():
-    total_pages = 10  # Adjust the number of pages
-    all_publications_df = pd.DataFrame(columns=["ID", "Title", "Summary", "Image Path", "PDF Path"])
-    for page_number in range(1, total_pages + 1):
-        page_url = f"{base_url}#first={(page_number - 1) * 10}"
-        print(f"\n{'-'*100}\nScraping page {page_number}: {page_url}\n{'-'*100}\n")
-        # Get the DataFrame for each page and append it to the main DataFrame
-        page_df = get_publications_from_page(page_url)
-        all_publications_df = pd.concat([all_publications_df, page_df], ignore_index=True)
+        publications_data.append(publication)
+
+    save_checkpoint(run_id, page_number, publications_data)
+    return publications_data
+
+
+def scrape_publications(run_id=None):
+    """
+    Scrapes the listing pages with the browser while a thread pool fetches the publication pages,
+    PDFs and images of pages already listed. Pass the same run_id on a retry to skip the listing
+    pages an earlier attempt finished. If a listing page fails to render, this raises once the other
+    pages are checkpointed, so the retry scrapes only the missing pages.
+    """
+    completed = load_checkpoint(run_id)
+    publications_data = [publication for page in sorted(completed) for publication in completed[page]]
+    if completed:
+        print(f"Resuming from checkpoint: {len(completed)} pages already scraped")
 
+    pending = []
+    failed_pages = []
+    previous_first_link = None
+    with ThreadPoolExecutor(max_workers=SCRAPER_DETAIL_WORKERS, thread_name_prefix="scraper") as executor:
+        try:
+            for page_number in range(1, SCRAPER_TOTAL_PAGES + 1):
+                if page_number in completed:
+                    continue
+                page_url = f"{base_url}#first={(page_number - 1) * 10}"
+                print(f"\n{'-'*100}\nScraping page {page_number}: {page_url}\n{'-'*100}\n")
+                try:
+                    soup, previous_first_link = load_listing_page(page_url, previous_first_link)
+                except TimeoutException:
+                    print(f"No results rendered for page {page_number} within {SCRAPER_WAIT_SECONDS}s.")
+                    failed_pages.append(page_number)
+                    continue
+                futures = [executor.submit(scrape_publication, listing) for listing in parse_listing(soup)]
+                pending.append((page_number, futures))
+
+                # Record pages whose downloads are done, in page order, while later pages are listed
+                while pending and all(future.done() for future in pending[0][1]):
+                    publications_data.extend(finish_page(run_id, *pending.pop(0)))
+        except BaseException:
+            # Checkpoint the pages already listed before failing, so the retry starts after them
+            for page_number, futures in pending:
+                try:
+                    finish_page(run_id, page_number, futures)
+                except Exception:
+                    break
+            raise
+
+        for page_number, futures in pending:
+            publications_data.extend(finish_page(run_id, page_number, futures))
+
+    if failed_pages:
+        # The other pages are checkpointed, so the Airflow retry only scrapes these again
+        raise TimeoutException(f"No results rendered for listing pages {failed_pages}")
+
+    # Convert the publications_data list to a DataFrame
+    # A publication listed on two pages (the listing shifting mid-scrape) is kept once
+    all_publications_df = pd.DataFrame(publications_data, columns=COLUMNS).drop_duplicates(subset="ID", ignore_index=True)
     # all_publications_df.to_csv("publications_data.csv", index=False)
     # print("Data saved to publications_data.csv")
     return all_publications_df
 
-# Close the Selenium browser after scraping
+# Close the Selenium browsers after scraping
 def close_driver():
-    driver.quit()
+    with _drivers_lock:
+        for driver in _drivers.values():
+            driver.quit()
+        _drivers.clear()
@@ -3,6 +3,7 @@ import pandas as pd
 import snowflake.connector
 from dotenv import load_dotenv
 from snowflake.connector.errors import ProgrammingError
+from snowflake.connector.pandas_tools import write_pandas
 
 load_dotenv(override=True)
 
@@ -10,6 +11,20 @@ load_dotenv(override=True)
 DATABASE = os.getenv("SNOWFLAKE_DATABASE")
 SCHEMA = os.getenv("SNOWFLAKE_SCHEMA")
 TABLE_NAME = os.getenv("SNOWFLAKE_TABLE", "PUBLICATIONS")
+# Scraped rows are bulk loaded into this session-scoped table and merged into TABLE_NAME
+STAGING_TABLE = f"{TABLE_NAME}_STAGING"
+# Rows loaded before IDs were derived from the publication URL carry scrape-order IDs below this;
+# URL-derived IDs are 60-bit hashes
+LEGACY_ID_LIMIT = 2 ** 32
+
+# DataFrame column -> table column
+COLUMN_MAP = {
+    "ID": "ID",
+    "Title": "TITLE",
+    "Summary": "SUMMARY",
+    "Image Path": "IMAGE_URL",
+    "PDF Path": "PDF_URL",
+}
 
 
 def connect_to_snowflake():
@@ -59,36 +74,58 @@ def validate_dataframe(df):
     if not required_columns.issubset(df.columns):
         raise ValueError("DataFrame columns do not match the required table structure.")
 
+def build_merge_sql():
+    columns = list(COLUMN_MAP.values())
+    changed = " OR ".join(f"NOT EQUAL_NULL(t.{c}, s.{c})" for c in columns if c != "ID")
+    return f"""
+    MERGE INTO {TABLE_NAME} t
+    USING {STAGING_TABLE} s
+    ON t.ID = s.ID
+    WHEN MATCHED AND ({changed}) THEN
+        UPDATE SET {", ".join(f"{c} = s.{c}" for c in columns if c != "ID")}
+    WHEN NOT MATCHED THEN
+        INSERT ({", ".join(columns)}) VALUES ({", ".join(f"s.{c}" for c in columns)});
+    """
+
 def upload_dataframe_to_snowflake(df, conn):
+    """
+    Loads the DataFrame into a temporary staging table in one bulk copy (Parquet files PUT to the
+    table stage) and applies it with a single MERGE: new IDs are inserted, changed rows updated.
+    Raises if the load fails, so that the task fails and is retried.
+    """
     if df.empty:
         print("DataFrame is empty. Skipping upload.")
         return
 
     validate_dataframe(df)
-    
+    staging_df = df.rename(columns=COLUMN_MAP)[list(COLUMN_MAP.values())].drop_duplicates(subset="ID", keep="last")
+
     cursor = conn.cursor()
     try:
-        rows_inserted=0
-        for _, row in df.iterrows():
-            check_sql = f"SELECT COUNT(*) FROM {TABLE_NAME} WHERE ID = %s"
-            cursor.execute(check_sql, (row["ID"],))
-            count = cursor.fetchone()[0]
-            
-            if count == 0:
-                sql = f"""
-                INSERT INTO {TABLE_NAME} (ID,Title, Summary, Image_URL, PDF_URL)
-                VALUES (%s, %s, %s, %s, %s);
-                """
-                cursor.execute(sql, (row["ID"], row["Title"], row["Summary"], row["Image Path"], row["PDF Path"]))
-                rows_inserted +=1
-        
+        cursor.execute(f"CREATE OR REPLACE TEMPORARY TABLE {STAGING_TABLE} LIKE {TABLE_NAME};")
+        success, _, nrows, _ = write_pandas(conn, staging_df, STAGING_TABLE, database=DATABASE, schema=SCHEMA,
+                                            quote_identifiers=False)
+        if not success:
+            raise ProgrammingError(f"Bulk load into {STAGING_TABLE} failed.")
+
+        cursor.execute(build_merge_sql())
+        counts = dict(zip([column[0] for column in cursor.description], cursor.fetchone()))
+        # One-off migration: drop legacy scrape-order rows now stored under their stable ID. Once
+        # they are gone this deletes nothing, and publications sharing a title are never touched.
+        cursor.execute(f"""
+        DELETE FROM {TABLE_NAME} t USING {STAGING_TABLE} s
+        WHERE t.TITLE = s.TITLE AND t.ID < {LEGACY_ID_LIMIT} AND t.ID NOT IN (SELECT ID FROM {STAGING_TABLE});
+        """)
         conn.commit()
-        print(f"Data upload successful. {rows_inserted} new rows inserted into Snowflake.")
+        print(f"Data upload successful. {nrows} rows staged, "
+              f"{counts.get('number of rows inserted', 0)} new rows inserted and "
+              f"{counts.get('number of rows updated', 0)} rows updated in Snowflake.")
         print(f"Snowflake Database Details:")
         print(f"  - Database: {DATABASE}")
         print(f"  - Schema: {SCHEMA}")
         print(f"  - Table: {TABLE_NAME}")
     except ProgrammingError as e:
         print(f"Error uploading data: {e}")
+        raise
     finally:
         cursor.close()
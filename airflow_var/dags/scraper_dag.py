@@ -1,7 +1,7 @@
 from airflow import DAG
 from airflow.operators.python import PythonOperator
 from datetime import datetime, timedelta
-from scripts.scraper import scrape_publications, close_driver
+from scripts.scraper import scrape_publications, close_driver, clear_checkpoint
 from scripts.snowflake_utils import connect_to_snowflake, setup_snowflake_database, upload_dataframe_to_snowflake
 import pandas as pd
 
@@ -18,23 +18,28 @@ default_args = {
 with DAG("data_ingestion_combined", default_args=default_args, schedule_interval="@daily") as dag:
 
     # Combined task function
-    def combined_task_callable():
-        # Step 1: Scrape publications and store in a DataFrame
+    def combined_task_callable(run_id, **context):
+        # Step 1: Scrape publications and store in a DataFrame; a retry of this run resumes
+        # from the pages the failed attempt already scraped
         #publications_df = pd.read_csv("/opt/airflow/dags/publications_data.csv")
-        publications_df = scrape_publications()  # Uncomment if scrape_publications is needed
+        try:
+            publications_df = scrape_publications(run_id)  # Uncomment if scrape_publications is needed
+        finally:
+            # Step 2: Close the Selenium driver
+            close_driver()
 
-        # Step 2: Set up Snowflake database and table if not already set up
+        # Step 3: Set up Snowflake database and table if not already set up
         conn = connect_to_snowflake()
         try:
             setup_snowflake_database(conn)
 
-            # Step 3: Upload scraped DataFrame to Snowflake
+            # Step 4: Upload scraped DataFrame to Snowflake
             upload_dataframe_to_snowflake(publications_df, conn)
         finally:
             conn.close()
 
-        # Step 4: Close the Selenium driver
-        close_driver()
+        # Only reached once the MERGE is committed; a failed upload keeps the checkpoint for the retry
+        clear_checkpoint(run_id)
 
     # Create a single task to perform all steps
     combined_task = PythonOperator(
@@ -1,61 +1,157 @@
+import hashlib
+import shutil
+import tempfile
 import requests
 import boto3
 import os
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
 from dotenv import load_dotenv
 from airflow.models import Variable
+from requests.adapters import HTTPAdapter
 
 load_dotenv()
 
+# Downloads are spooled to disk past S3_MULTIPART_CHUNK_MB and uploaded in parts of that size,
+# S3_UPLOAD_CONCURRENCY parts of a file at a time, so memory use stays bounded however large the PDF is
+S3_MULTIPART_CHUNK_MB = int(Variable.get("S3_MULTIPART_CHUNK_MB", default_var="8"))
+S3_UPLOAD_CONCURRENCY = int(Variable.get("S3_UPLOAD_CONCURRENCY", default_var="4"))
+S3_MAX_POOL_CONNECTIONS = int(Variable.get("S3_MAX_POOL_CONNECTIONS", default_var="32"))
+DOWNLOAD_TIMEOUT = int(Variable.get("DOWNLOAD_TIMEOUT", default_var="60"))
+
 # Initialize S3 client
 s3_client = boto3.client(
     's3',
     aws_access_key_id=Variable.get("AWS_ACCESS_KEY_ID"),
     aws_secret_access_key=Variable.get("AWS_SECRET_ACCESS_KEY"),
-    region_name=Variable.get("AWS_REGION")
+    region_name=Variable.get("AWS_REGION"),
+    config=Config(max_pool_connections=S3_MAX_POOL_CONNECTIONS)
 )
 
-def upload_to_s3(file_content, bucket, s3_path):
-    try:
-        if not isinstance(file_content, (bytes, str)):
-            print(f"Unexpected file_content type: {type(file_content)}")
-        if not isinstance(bucket, str) or not isinstance(s3_path, str):
-            print(f"Unexpected bucket or s3_path type: bucket={type(bucket)}, s3_path={type(s3_path)}")
-        s3_client.put_object(Bucket=bucket, Key=s3_path, Body=file_content)
-        s3_url = f"https://{bucket}.s3.amazonaws.com/{s3_path}"
-        print(f"Uploaded to S3: {s3_url}")
-        return s3_url
-    except Exception as e:
-        print(f"Failed to upload to S3: {e}")
-        return ""
+transfer_config = TransferConfig(
+    multipart_threshold=S3_MULTIPART_CHUNK_MB * 1024 * 1024,
+    multipart_chunksize=S3_MULTIPART_CHUNK_MB * 1024 * 1024,
+    max_concurrency=S3_UPLOAD_CONCURRENCY,
+    use_threads=True
+)
+
+# Keep-alive HTTP session for the PDF and image downloads
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(pool_maxsize=S3_MAX_POOL_CONNECTIONS))
+
+
+class ChecksumReader:
+    """
+    File-like wrapper over a download stream that counts and SHA-256 hashes the bytes as S3 reads them.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size=-1):
+        chunk = self.stream.read(None if size is None or size < 0 else size)
+        self.sha256.update(chunk)
+        self.size += len(chunk)
+        return chunk
+
+
+def upload_to_s3(fileobj, bucket, s3_path, content_type=None, metadata=None):
+    """
+    Uploads a file-like object to S3, in parallel parts above the multipart threshold. S3 verifies
+    a SHA-256 checksum of every part.
+    """
+    extra_args = {"ChecksumAlgorithm": "SHA256", "Metadata": metadata or {}}
+    if content_type:
+        extra_args["ContentType"] = content_type
+    s3_client.upload_fileobj(fileobj, bucket, s3_path, ExtraArgs=extra_args, Config=transfer_config)
+    s3_url = f"https://{bucket}.s3.amazonaws.com/{s3_path}"
+    print(f"Uploaded to S3: {s3_url}")
+    return s3_url
+
 
-def download_pdf(title, pdf_url):
+def get_s3_metadata(bucket, s3_path):
+    """
+    Returns the user metadata of an S3 object, or None if the object does not exist.
+    """
     try:
-        response = requests.get(pdf_url)
+        return s3_client.head_object(Bucket=bucket, Key=s3_path)["Metadata"]
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+
+
+def conditional_headers(metadata):
+    """
+    Request headers that make the source answer 304 Not Modified if the copy in S3 is current.
+    """
+    headers = {}
+    if metadata and metadata.get("source-etag"):
+        headers["If-None-Match"] = metadata["source-etag"]
+    if metadata and metadata.get("source-last-modified"):
+        headers["If-Modified-Since"] = metadata["source-last-modified"]
+    return headers
+
+
+def check_download(reader, expected_size, url):
+    if reader.size == 0:
+        raise ValueError(f"No content in {url}.")
+    if expected_size and int(expected_size) != reader.size:
+        raise IOError(f"Download of {url} was cut short: {reader.size} of {expected_size} bytes")
+
+
+def stream_to_s3(url, s3_path, content_type):
+    """
+    Copies a download into S3 unless the copy already there is unchanged. The source's ETag and
+    Last-Modified are kept as object metadata and sent back as a conditional GET, so an unchanged
+    file costs one HEAD and one 304. The download is spooled to disk and checked before anything
+    is written, so a truncated or empty response never replaces the last good copy; it is only
+    uploaded if its SHA-256 differs from the one stored with the object.
+    """
+    bucket = os.getenv("AWS_BUCKET_NAME")
+    s3_url = f"https://{bucket}.s3.amazonaws.com/{s3_path}"
+    metadata = get_s3_metadata(bucket, s3_path)
+    with http_session.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT, headers=conditional_headers(metadata)) as response:
+        if response.status_code == 304:
+            print(f"Unchanged, skipped: {s3_url}")
+            return s3_url
         response.raise_for_status()
+        response.raw.decode_content = True
+        content_type = response.headers.get("Content-Type", content_type)
+        expected_size = None if response.headers.get("Content-Encoding") else response.headers.get("Content-Length")
+        source_metadata = {key: response.headers[header] for key, header in
+                           [("source-etag", "ETag"), ("source-last-modified", "Last-Modified")]
+                           if response.headers.get(header)}
+        reader = ChecksumReader(response.raw)
 
-        if response.content:  # Ensure response has content
-            s3_path = f"assignment3/pdfs/{sanitize_filename(title)}.pdf"
-            return upload_to_s3(response.content, os.getenv("AWS_BUCKET_NAME"), s3_path)
-        else:
-            print(f"No content in PDF for {title}.")
-            return ""
+        with tempfile.SpooledTemporaryFile(max_size=transfer_config.multipart_chunksize) as spool:
+            shutil.copyfileobj(reader, spool, transfer_config.multipart_chunksize)
+            check_download(reader, expected_size, url)
+            sha256 = reader.sha256.hexdigest()
+            if metadata and metadata.get("sha256") == sha256 and all(
+                    metadata.get(key) == value for key, value in source_metadata.items()):
+                print(f"Unchanged, skipped: {s3_url}")
+                return s3_url
+            spool.seek(0)
+            upload_to_s3(spool, bucket, s3_path, content_type, {"sha256": sha256, **source_metadata})
+    print(f"Verified {reader.size} bytes, sha256 {sha256}")
+    return s3_url
+
+
+def download_pdf(publication_id, title, pdf_url):
+    try:
+        s3_path = f"assignment3/pdfs/{publication_id}.pdf"
+        return stream_to_s3(pdf_url, s3_path, "application/pdf")
     except Exception as e:
         print(f"Failed to download PDF for {title}. Error: {e}")
         return ""
 
-def save_image(title, image_url):
+def save_image(publication_id, title, image_url):
     try:
-        response = requests.get(image_url)
-        response.raise_for_status()
-        if response.content:
-            s3_path = f"assignment3/images/{sanitize_filename(title)}.jpg"
-            return upload_to_s3(response.content, os.getenv("AWS_BUCKET_NAME"), s3_path)
-        else:
-            print(f"No content in image for {title}.")
-            return ""
+        s3_path = f"assignment3/images/{publication_id}.jpg"
+        return stream_to_s3(image_url, s3_path, "image/jpeg")
     except Exception as e:
         print(f"Failed to save image for {title}. Error: {e}")
         return ""
-
-def sanitize_filename(name):
-    return "".join([c if c.isalnum() or c in " ._-()" else "_" for c in name])
@@ -0,0 +1,187 @@
+# app/cache.py
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def content_hash(*parts) -> str:
+    """
+    Returns a SHA-256 hex digest over the given str/bytes parts.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        digest.update(part)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def file_hash(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Returns the SHA-256 hex digest of a file's contents, read in chunks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes free text for cache keys: case-folded with whitespace collapsed.
+    """
+    return " ".join(text.split()).casefold()
+
+
+class DiskLRUCache:
+    """
+    Persistent key/value cache storing one JSON file per entry under a directory.
+    Entries are touched on every hit and the least recently used ones are evicted
+    once the directory grows past max_bytes.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, compress: bool = False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self._total_bytes = sum(size for _, size, _ in self._scan())
+
+    def _path(self, key: str) -> str:
+        suffix = ".json.gz" if self.compress else ".json"
+        return os.path.join(self.directory, key[:2], key + suffix)
+
+    def _scan(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def get(self, key: str, default=None):
+        path = self._path(key)
+        try:
+            opener = gzip.open if self.compress else open
+            with opener(path, "rt", encoding="utf-8") as f:
+                value = json.load(f)
+        except FileNotFoundError:
+            return default
+        except (OSError, ValueError) as e:
+            logging.warning(f"[WARN] Dropping unreadable cache entry {path}: {e}")
+            self.delete(key)
+            return default
+        try:
+            # Refresh the mtime so eviction sees this entry as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return value
+
+    def set(self, key: str, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        payload = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        if self.compress:
+            payload = gzip.compress(payload)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+        try:
+            # An overwritten entry only grows the cache by the difference in size
+            previous_size = os.stat(path).st_size
+        except FileNotFoundError:
+            previous_size = 0
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._total_bytes += len(payload) - previous_size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def _evict(self):
+        # Rescan so that entries written by other workers are accounted for, then
+        # drop the oldest entries until the cache is back to 90% of its budget
+        entries = sorted(self._scan(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+        self._total_bytes = total
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory LRU cache with hit/miss counters and an optional per-entry TTL.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                if self.ttl_seconds is None or time.monotonic() - stored_at < self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
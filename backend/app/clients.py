@@ -0,0 +1,101 @@
+# app/clients.py
+import logging
+import os
+import threading
+
+import boto3
+import requests
+from botocore.config import Config
+from llama_index.llms.nvidia import NVIDIA
+from llama_index.llms.openai import OpenAI
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Process-wide API clients, created once at startup (see the lifespan in app.main) and reused by
+# every request so that connection pools, TLS sessions and client setup are not repeated per call.
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "32"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "32"))
+CHART_LLM_MODEL = "meta/llama-3.1-70b-instruct"
+
+_clients = {}
+_clients_lock = threading.RLock()
+
+
+def _get_or_create(name: str, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = factory()
+                _clients[name] = client
+    return client
+
+
+def _create_http_session() -> requests.Session:
+    # The session only POSTs to paid inference endpoints, where a 5xx or a dropped response may
+    # come after the work was done (and billed). Only retry what never reached the model: failed
+    # connections and 429 rate limiting. allowed_methods=None lets those apply to POST.
+    retry = Retry(total=HTTP_RETRIES, connect=HTTP_RETRIES, read=0, other=0, status_forcelist=[429],
+                  backoff_factor=0.5, allowed_methods=None)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_http_session() -> requests.Session:
+    """
+    Keep-alive HTTP session for the NVIDIA inference APIs.
+    """
+    return _get_or_create("http", _create_http_session)
+
+
+def get_s3_client():
+    return _get_or_create("s3", lambda: boto3.client(
+        "s3", config=Config(max_pool_connections=S3_MAX_POOL_CONNECTIONS)
+    ))
+
+
+def get_llm() -> OpenAI:
+    """
+    OpenAI LLM used to answer chat and summary queries.
+    """
+    return _get_or_create("llm", OpenAI)
+
+
+def get_chart_llm() -> NVIDIA:
+    """
+    NVIDIA LLM used to explain linearized chart tables.
+    """
+    return _get_or_create("chart_llm", lambda: NVIDIA(model_name=CHART_LLM_MODEL))
+
+
+def get_report_service():
+    from app.services.report_service import ReportService
+    return _get_or_create("report_service", ReportService)
+
+
+def init_clients():
+    """
+    Creates every client up front. A client that cannot be created yet (e.g. a missing key) is
+    logged and created on first use instead, so the app still starts.
+    """
+    from app.services.rag_service import get_vector_store
+    for name, factory in [("http", get_http_session), ("s3", get_s3_client), ("llm", get_llm),
+                          ("chart_llm", get_chart_llm), ("vector_store", get_vector_store),
+                          ("report_service", get_report_service)]:
+        try:
+            factory()
+        except Exception as e:
+            logging.warning(f"[WARN] Could not create {name} client at startup: {e}")
+
+
+def close_clients():
+    with _clients_lock:
+        session = _clients.get("http")
+        if session is not None:
+            session.close()
+        _clients.clear()
@@ -0,0 +1,42 @@
+# app/concurrency.py
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Bounded thread pools that async routes hand their blocking work (Pinecone, OpenAI, boto3,
+# Snowflake, PDF rendering, file I/O) to, so the event loop keeps serving other requests.
+# Each kind of work has its own pool so slow report jobs cannot starve chat traffic.
+POOL_SIZES = {
+    "chat": int(os.getenv("CHAT_WORKERS", "32")),
+    "db": int(os.getenv("DB_WORKERS", "8")),
+    "report": int(os.getenv("REPORT_WORKERS", "2")),
+}
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(pool: str) -> ThreadPoolExecutor:
+    with _executors_lock:
+        executor = _executors.get(pool)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=POOL_SIZES[pool], thread_name_prefix=f"{pool}-worker")
+            _executors[pool] = executor
+        return executor
+
+
+async def run_in_pool(pool: str, func, *args, **kwargs):
+    """
+    Runs a blocking call on the named thread pool and awaits its result.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(pool), functools.partial(func, *args, **kwargs))
+
+
+def shutdown_pools():
+    with _executors_lock:
+        for executor in _executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        _executors.clear()
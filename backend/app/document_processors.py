@@ -13,7 +13,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import multiprocessing
 import os
+import queue
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
 import pymupdf as fitz
 from pptx import Presentation
 import subprocess
@@ -23,55 +31,245 @@ from app.utils import (
     process_text_blocks, save_uploaded_file
 )
 
+# Worker processes used to extract PDF pages, shared by every document; 0 keeps extraction sequential
+PDF_PARSE_WORKERS = int(os.getenv("PDF_PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Threads used to caption tables and images (each endpoint is further limited in app.utils)
+CAPTION_WORKERS = int(os.getenv("CAPTION_WORKERS", "16"))
+# Pages extracted/captioned ahead of the consumer in parallel mode
+MAX_PENDING_PAGES = int(os.getenv("MAX_PENDING_PAGES", "8"))
+# Documents buffered between a producer and its consumer by prefetch()
+PREFETCH_BUFFER_SIZE = int(os.getenv("PREFETCH_BUFFER_SIZE", "64"))
+
+
+def get_pdf_documents(pdf_file, parallel=None, failures=None):
+    """Process a PDF file and extract text, tables, and images. Returns [] if the PDF cannot be opened."""
+    try:
+        pdf_bytes, f = _open_pdf(pdf_file)
+    except Exception:
+        return []
+    return list(_iter_open_pdf(pdf_file.name, pdf_bytes, f, parallel, failures))
+
 
-def get_pdf_documents(pdf_file):
-    """Process a PDF file and extract text, tables, and images."""
-    all_pdf_documents = []
-    ongoing_tables = {}
+def iter_pdf_documents(pdf_file, parallel=None, failures=None):
+    """Process a PDF file page by page, yielding text, table and image Documents as each page is done.
 
+    With parallel=True (the default when PDF_PARSE_WORKERS > 0) pages are extracted in the shared
+    process pool and tables/images are captioned concurrently in a thread pool, with at most
+    MAX_PENDING_PAGES pages in flight. Documents are yielded in the same order and with the
+    same IDs as the sequential path.
+
+    Raises if the PDF cannot be opened (unlike get_pdf_documents, so that ingestion can tell an
+    unreadable PDF from an empty one). Tables that could not be extracted or captioned are
+    skipped and, if a failures list is given, recorded in it.
+    """
+    pdf_bytes, f = _open_pdf(pdf_file)
+    yield from _iter_open_pdf(pdf_file.name, pdf_bytes, f, parallel, failures)
+
+
+def _open_pdf(pdf_file):
     try:
-        f = fitz.open(stream=pdf_file.read(), filetype="pdf")
+        pdf_bytes = pdf_file.read()
+        return pdf_bytes, fitz.open(stream=pdf_bytes, filetype="pdf")
     except Exception as e:
         print(f"Error opening or processing the PDF file: {e}")
-        return []
+        raise
+
+
+def _iter_open_pdf(filename, pdf_bytes, f, parallel=None, failures=None):
+    if parallel is None:
+        parallel = PDF_PARSE_WORKERS > 0
+
+    if parallel:
+        page_count = len(f)
+        f.close()
+        yield from _iter_pdf_documents_parallel(filename, pdf_bytes, page_count, failures)
+        return
+
+    try:
+        for i in range(len(f)):
+            extracted_page = extract_page(filename, f[i], i)
+            table_descriptions = [caption_table(table) for table in extracted_page["tables"]]
+            image_descriptions = [caption_image(image) for image in extracted_page["images"]]
+            record_failures(failures, filename, extracted_page, table_descriptions)
+            yield from build_page_documents(filename, extracted_page, table_descriptions, image_descriptions)
+    finally:
+        f.close()
+
+
+_extract_pool = None
+_extract_pool_lock = threading.Lock()
+
+
+def get_extract_pool():
+    """Returns the process pool shared by all PDF extractions, starting it on first use."""
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is None:
+            # Spawn rather than fork: this runs inside a threaded server, and a forked child could
+            # inherit locks held by other threads (HTTP pools, captioning semaphores) and deadlock
+            _extract_pool = ProcessPoolExecutor(max_workers=max(PDF_PARSE_WORKERS, 1),
+                                                mp_context=multiprocessing.get_context("spawn"))
+        return _extract_pool
+
+
+def shutdown_extract_pool(pool=None):
+    """Shuts down the shared extraction pool (or only the given one, if it is still the shared pool)."""
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is None or (pool is not None and pool is not _extract_pool):
+            return
+        _extract_pool.shutdown(wait=False, cancel_futures=True)
+        _extract_pool = None
+
+
+def _iter_pdf_documents_parallel(filename, pdf_bytes, page_count, failures=None):
+    """Extract pages in the shared process pool and caption their tables and images through a thread pool."""
+    # The worker processes open the PDF from a file rather than receiving its bytes with every page
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as pdf_copy:
+        pdf_copy.write(pdf_bytes)
+        pdf_copy.flush()
+        try:
+            yield from _extract_pages_parallel(get_extract_pool(), pdf_copy.name, filename, page_count, failures)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool for the next document
+            shutdown_extract_pool()
+            raise
+
+
+def _extract_pages_parallel(process_pool, pdf_path, filename, page_count, failures):
+    extractions = []
+    with ThreadPoolExecutor(max_workers=CAPTION_WORKERS) as caption_pool:
+
+        def submit_page(pagenum):
+            # Resolves to (extracted_page, table caption futures, image caption futures) as soon
+            # as the page is extracted, so captioning starts without waiting for earlier pages
+            captioned = Future()
+
+            def on_extracted(extraction):
+                try:
+                    extracted_page = extraction.result()
+                    captioned.set_result((
+                        extracted_page,
+                        [caption_pool.submit(caption_table, table) for table in extracted_page["tables"]],
+                        [caption_pool.submit(caption_image, image) for image in extracted_page["images"]]
+                    ))
+                except BaseException as e:
+                    captioned.set_exception(e)
+
+            extraction = process_pool.submit(_extract_worker_page, pdf_path, filename, pagenum)
+            extractions.append(extraction)
+            extraction.add_done_callback(on_extracted)
+            return captioned
+
+        try:
+            pending = deque(submit_page(pagenum) for pagenum in range(min(MAX_PENDING_PAGES, page_count)))
+            next_page = len(pending)
+            while pending:
+                extracted_page, table_futures, image_futures = pending.popleft().result()
+                if next_page < page_count:
+                    pending.append(submit_page(next_page))
+                    next_page += 1
+                table_descriptions = [future.result() for future in table_futures]
+                image_descriptions = [future.result() for future in image_futures]
+                record_failures(failures, filename, extracted_page, table_descriptions)
+                yield from build_page_documents(filename, extracted_page, table_descriptions, image_descriptions)
+        finally:
+            # The pool is shared: don't leave pages of an abandoned document queued in it
+            for extraction in extractions:
+                extraction.cancel()
+
+
+_worker_pdf = None
+
+
+def _extract_worker_page(pdf_path, filename, pagenum):
+    """Process-pool task: extract a single page, keeping the worker's last PDF open between pages."""
+    global _worker_pdf
+    if _worker_pdf is None or _worker_pdf[0] != pdf_path:
+        if _worker_pdf is not None:
+            _worker_pdf[1].close()
+        _worker_pdf = (pdf_path, fitz.open(pdf_path))
+    return extract_page(filename, _worker_pdf[1][pagenum], pagenum)
+
+
+def prefetch(iterable, max_buffered=None):
+    """Run an iterator in a background thread, buffering at most max_buffered items.
+
+    Lets a consumer (e.g. embedding and upserting) work while the producer (e.g. PDF parsing)
+    keeps going, while the bounded buffer keeps memory flat when the consumer falls behind.
+    """
+    buffer = queue.Queue(maxsize=max_buffered or PREFETCH_BUFFER_SIZE)
+    done = object()
+    stopped = threading.Event()
+
+    def offer(entry):
+        # Returns False once the consumer has stopped, so the producer never blocks on a full buffer
+        while not stopped.is_set():
+            try:
+                buffer.put(entry, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
 
-    for i in range(len(f)):
-        page = f[i]
-        text_blocks = [block for block in page.get_text("blocks", sort=True)
-                       if
-                       block[-1] == 0 and not (block[1] < page.rect.height * 0.1 or block[3] > page.rect.height * 0.9)]
-        grouped_text_blocks = process_text_blocks(text_blocks)
-
-        table_docs, table_bboxes, ongoing_tables = parse_all_tables(pdf_file.name, page, i, text_blocks, ongoing_tables)
-        all_pdf_documents.extend(table_docs)
-
-        image_docs = parse_all_images(pdf_file.name, page, i, text_blocks)
-        all_pdf_documents.extend(image_docs)
-
-        for text_block_ctr, (heading_block, content) in enumerate(grouped_text_blocks, 1):
-            heading_bbox = fitz.Rect(heading_block[:4])
-            if not any(heading_bbox.intersects(table_bbox) for table_bbox in table_bboxes):
-                bbox = {"x1": heading_block[0], "y1": heading_block[1], "x2": heading_block[2], "x3": heading_block[3]}
-                text_doc = Document(
-                    text=f"{heading_block[4]}\n{content}",
-                    metadata={
-                        **bbox,
-                        "type": "text",
-                        "page_num": i,
-                        "source": f"{pdf_file.name[:-4]}-page{i}-block{text_block_ctr}"
-                    },
-                    id_=f"{pdf_file.name[:-4]}-page{i}-block{text_block_ctr}"
-                )
-                all_pdf_documents.append(text_doc)
-
-    f.close()
-    return all_pdf_documents
-
-
-def parse_all_tables(filename, page, pagenum, text_blocks, ongoing_tables):
-    """Extract tables from a PDF page."""
-    table_docs = []
+    def produce():
+        try:
+            for item in iterable:
+                if not offer((item, None)):
+                    return
+            offer((done, None))
+        except Exception as e:
+            offer((done, e))
+        finally:
+            close = getattr(iterable, "close", None)
+            if close is not None:
+                close()
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stopped.set()
+
+
+def extract_page(filename, page, pagenum):
+    """Extract text blocks, tables and images from a PDF page without any network calls.
+
+    Returns plain, picklable data so extraction can run in a worker process.
+    """
+    text_blocks = [block for block in page.get_text("blocks", sort=True)
+                   if
+                   block[-1] == 0 and not (block[1] < page.rect.height * 0.1 or block[3] > page.rect.height * 0.9)]
+    grouped_text_blocks = process_text_blocks(text_blocks)
+
+    tables, table_bboxes, table_error = extract_tables(page, pagenum, text_blocks)
+    images = extract_images(page, pagenum, text_blocks)
+
+    texts = []
+    for text_block_ctr, (heading_block, content) in enumerate(grouped_text_blocks, 1):
+        heading_bbox = fitz.Rect(heading_block[:4])
+        if not any(heading_bbox.intersects(table_bbox) for table_bbox in table_bboxes):
+            texts.append({
+                "block": text_block_ctr,
+                "text": f"{heading_block[4]}\n{content}",
+                "bbox": {"x1": heading_block[0], "y1": heading_block[1], "x2": heading_block[2], "x3": heading_block[3]}
+            })
+
+    return {"page_num": pagenum, "tables": tables, "table_error": table_error, "images": images, "texts": texts}
+
+
+def extract_tables(page, pagenum, text_blocks):
+    """Extract tables from a PDF page. Returns (tables, their bounding boxes, error message or None)."""
+    tables_data = []
     table_bboxes = []
+    error = None
     try:
         tables = page.find_tables(horizontal_strategy="lines_strict", vertical_strategy="lines_strict")
         for tab in tables:
@@ -79,7 +277,7 @@ def parse_all_tables(filename, page, pagenum, text_blocks, ongoing_tables):
                 pandas_df = tab.to_pandas()
                 tablerefdir = os.path.join(os.getcwd(), "vectorstore/table_references")
                 os.makedirs(tablerefdir, exist_ok=True)
-                df_xlsx_path = os.path.join(tablerefdir, f"table{len(table_docs) + 1}-page{pagenum}.xlsx")
+                df_xlsx_path = os.path.join(tablerefdir, f"table{len(tables_data) + 1}-page{pagenum}.xlsx")
                 pandas_df.to_excel(df_xlsx_path)
                 bbox = fitz.Rect(tab.bbox)
                 table_bboxes.append(bbox)
@@ -87,33 +285,28 @@ def parse_all_tables(filename, page, pagenum, text_blocks, ongoing_tables):
                 before_text, after_text = extract_text_around_item(text_blocks, bbox, page.rect.height)
 
                 table_img = page.get_pixmap(clip=bbox)
-                table_img_path = os.path.join(tablerefdir, f"table{len(table_docs) + 1}-page{pagenum}.jpg")
+                table_img_path = os.path.join(tablerefdir, f"table{len(tables_data) + 1}-page{pagenum}.jpg")
                 table_img.save(table_img_path)
-                description = process_graph(table_img.tobytes())
 
-                caption = before_text.replace("\n", " ") + description + after_text.replace("\n", " ")
-                if before_text == "" and after_text == "":
-                    caption = " ".join(tab.header.names)
-                table_metadata = {
-                    "source": f"{filename[:-4]}-page{pagenum}-table{len(table_docs) + 1}",
+                tables_data.append({
+                    "index": len(tables_data) + 1,
                     "dataframe": df_xlsx_path,
                     "image": table_img_path,
-                    "caption": caption,
-                    "type": "table",
-                    "page_num": pagenum
-                }
-                all_cols = ", ".join(list(pandas_df.columns.values))
-                doc = Document(text=f"This is a table with the caption: {caption}\nThe columns are {all_cols}",
-                               metadata=table_metadata)
-                table_docs.append(doc)
+                    "image_bytes": table_img.tobytes(),
+                    "before_text": before_text,
+                    "after_text": after_text,
+                    "header_names": list(tab.header.names),
+                    "columns": [str(column) for column in pandas_df.columns.values]
+                })
     except Exception as e:
         print(f"Error during table extraction: {e}")
-    return table_docs, table_bboxes, ongoing_tables
+        error = str(e)
+    return tables_data, table_bboxes, error
 
 
-def parse_all_images(filename, page, pagenum, text_blocks):
+def extract_images(page, pagenum, text_blocks):
     """Extract images from a PDF page."""
-    image_docs = []
+    images_data = []
     image_info_list = page.get_image_info(xrefs=True)
     page_rect = page.rect
 
@@ -138,21 +331,95 @@ def parse_all_images(filename, page, pagenum, text_blocks):
         if before_text == "" and after_text == "":
             continue
 
-        image_description = " "
-        if is_graph(image_data):
-            image_description = process_graph(image_data)
+        images_data.append({
+            "xref": xref,
+            "image": image_path,
+            "image_bytes": image_data,
+            "before_text": before_text,
+            "after_text": after_text
+        })
+    return images_data
+
+
+def caption_table(table):
+    """Describe a table image; returns None if captioning fails so the table is skipped."""
+    try:
+        return process_graph(table["image_bytes"])
+    except Exception as e:
+        print(f"Error during table captioning: {e}")
+        return None
+
+
+def caption_image(image):
+    """Describe an image if it is a graph, plot, chart or table."""
+    if is_graph(image["image_bytes"]):
+        return process_graph(image["image_bytes"])
+    return " "
+
+
+def record_failures(failures, filename, extracted_page, table_descriptions):
+    """Record the tables of a page that could not be extracted or captioned."""
+    if failures is None:
+        return
+    pagenum = extracted_page["page_num"]
+    if extracted_page.get("table_error"):
+        failures.append(f"{filename} page {pagenum}: table extraction failed ({extracted_page['table_error']})")
+    for table, description in zip(extracted_page["tables"], table_descriptions):
+        if description is None:
+            failures.append(f"{filename} page {pagenum}: captioning table {table['index']} failed")
 
-        caption = before_text.replace("\n", " ") + image_description + after_text.replace("\n", " ")
 
+def build_page_documents(filename, extracted_page, table_descriptions, image_descriptions):
+    """Build the Documents of one page from its extracted items and their captions."""
+    pagenum = extracted_page["page_num"]
+    page_documents = []
+
+    for table, description in zip(extracted_page["tables"], table_descriptions):
+        if description is None:
+            continue
+        before_text, after_text = table["before_text"], table["after_text"]
+        caption = before_text.replace("\n", " ") + description + after_text.replace("\n", " ")
+        if before_text == "" and after_text == "":
+            caption = " ".join(table["header_names"])
+        source = f"{filename[:-4]}-page{pagenum}-table{table['index']}"
+        table_metadata = {
+            "source": source,
+            "dataframe": table["dataframe"],
+            "image": table["image"],
+            "caption": caption,
+            "type": "table",
+            "page_num": pagenum
+        }
+        all_cols = ", ".join(table["columns"])
+        page_documents.append(Document(text=f"This is a table with the caption: {caption}\nThe columns are {all_cols}",
+                                       metadata=table_metadata, id_=source))
+
+    for image, image_description in zip(extracted_page["images"], image_descriptions):
+        caption = image["before_text"].replace("\n", " ") + image_description + image["after_text"].replace("\n", " ")
+        source = f"{filename[:-4]}-page{pagenum}-image{image['xref']}"
         image_metadata = {
-            "source": f"{filename[:-4]}-page{pagenum}-image{xref}",
-            "image": image_path,
+            "source": source,
+            "image": image["image"],
             "caption": caption,
             "type": "image",
             "page_num": pagenum
         }
-        image_docs.append(Document(text="This is an image with the caption: " + caption, metadata=image_metadata))
-    return image_docs
+        page_documents.append(Document(text="This is an image with the caption: " + caption,
+                                       metadata=image_metadata, id_=source))
+
+    for text in extracted_page["texts"]:
+        source = f"{filename[:-4]}-page{pagenum}-block{text['block']}"
+        page_documents.append(Document(
+            text=text["text"],
+            metadata={
+                **text["bbox"],
+                "type": "text",
+                "page_num": pagenum,
+                "source": source
+            },
+            id_=source
+        ))
+    return page_documents
 
 
 def process_ppt_file(ppt_path):
@@ -233,36 +500,39 @@ def extract_text_and_notes_from_ppt(ppt_path):
 
 def load_multimodal_data(files):
     """Load and process multiple file types."""
-    documents = []
+    return list(iter_multimodal_data(files))
+
+
+def iter_multimodal_data(files):
+    """Load and process multiple file types, yielding Documents as each file (or PDF page) is processed."""
     for file in files:
         file_extension = os.path.splitext(file.name.lower())[1]
         if file_extension in ('.png', '.jpg', '.jpeg'):
             image_content = file.read()
             image_text = describe_image(image_content)
-            doc = Document(text=image_text, metadata={"source": file.name, "type": "image"})
-            documents.append(doc)
+            yield Document(text=image_text, metadata={"source": file.name, "type": "image"})
         elif file_extension == '.pdf':
             try:
-                pdf_documents = get_pdf_documents(file)
-                documents.extend(pdf_documents)
+                yield from iter_pdf_documents(file)
             except Exception as e:
                 print(f"Error processing PDF {file.name}: {e}")
         elif file_extension in ('.ppt', '.pptx'):
             try:
-                ppt_documents = process_ppt_file(save_uploaded_file(file))
-                documents.extend(ppt_documents)
+                yield from process_ppt_file(save_uploaded_file(file))
             except Exception as e:
                 print(f"Error processing PPT {file.name}: {e}")
         else:
             text = file.read().decode("utf-8")
-            doc = Document(text=text, metadata={"source": file.name, "type": "text"})
-            documents.append(doc)
-    return documents
+            yield Document(text=text, metadata={"source": file.name, "type": "text"})
 
 
 def load_data_from_directory(directory):
     """Load and process multiple file types from a directory."""
-    documents = []
+    return list(iter_data_from_directory(directory))
+
+
+def iter_data_from_directory(directory):
+    """Load and process multiple file types from a directory, yielding Documents as they are processed."""
     for filename in os.listdir(directory):
         filepath = os.path.join(directory, filename)
         file_extension = os.path.splitext(filename.lower())[1]
@@ -273,24 +543,21 @@ def load_data_from_directory(directory):
             image_text = describe_image(image_content)
             doc = Document(text=image_text, metadata={"source": filename, "type": "image"})
             print(doc)
-            documents.append(doc)
+            yield doc
         elif file_extension == '.pdf':
             with open(filepath, "rb") as pdf_file:
                 try:
-                    pdf_documents = get_pdf_documents(pdf_file)
-                    documents.extend(pdf_documents)
+                    yield from iter_pdf_documents(pdf_file)
                 except Exception as e:
                     print(f"Error processing PDF {filename}: {e}")
         elif file_extension in ('.ppt', '.pptx'):
             try:
                 ppt_documents = process_ppt_file(filepath)
-                documents.extend(ppt_documents)
                 print(ppt_documents)
+                yield from ppt_documents
             except Exception as e:
                 print(f"Error processing PPT {filename}: {e}")
         else:
             with open(filepath, "r", encoding="utf-8") as text_file:
                 text = text_file.read()
-            doc = Document(text=text, metadata={"source": filename, "type": "text"})
-            documents.append(doc)
-    return documents
\ No newline at end of file
+            yield Document(text=text, metadata={"source": filename, "type": "text"})
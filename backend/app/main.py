@@ -1,4 +1,5 @@
 import os
+from contextlib import asynccontextmanager
 
 import uvicorn
 from fastapi import FastAPI, Request, Depends, HTTPException
@@ -9,14 +10,30 @@ from llama_index.core.base.llms.types import ChatMessage, MessageRole
 from llama_index.llms.nvidia import NVIDIA
 from sqlalchemy.orm import Session
 from app.routes import auth_routes, summary_routes, publications_routes
+from app.clients import close_clients, init_clients
+from app.concurrency import run_in_pool, shutdown_pools
+from app.document_processors import shutdown_extract_pool
 from app.routes.helpers import markdown_to_pdf
-from app.services import rag_service
+from app.services import job_queue, rag_service
 from app.services.auth_service import verify_token
 from app.services.database_service import get_db
 from fastapi.middleware.cors import CORSMiddleware
 
+# Create the shared API clients at startup and release them and the thread pools on shutdown
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await run_in_pool("chat", init_clients)
+    if job_queue.RUN_JOB_WORKERS:
+        job_queue.start_workers()
+    yield
+    # Off the event loop, so in-flight requests keep being served while the workers wind down
+    await run_in_pool("chat", job_queue.stop_workers)
+    close_clients()
+    shutdown_pools()
+    shutdown_extract_pool()
+
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -57,6 +74,14 @@ def read_root():
 async def health_check():
     return {"status": "ok"}
 
+# Hit/miss counters of the in-process caches
+@app.get("/cache/stats")
+async def cache_stats():
+    return {
+        "query_embeddings": rag_service.query_embedding_cache.stats(),
+        "answers": rag_service.answer_cache.stats()
+    }
+
 # Example of a protected route
 @app.get("/protected")
 async def protected_route(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
@@ -1,7 +1,7 @@
 import json
 import logging
 import os
-from typing import List
+from typing import List, Optional
 
 from pydantic import BaseModel, Field
 
@@ -18,6 +18,7 @@ CHAT_HISTORY_DIR = "chat_histories"
 class ChatRequest(BaseModel):
     document_id: str = Field(..., description="Unique identifier for the chat session.")
     message: str = Field(..., description="The user's message to the assistant.")
+    document_ids: Optional[List[str]] = Field(None, description="Documents to retrieve from; defaults to document_id only.")
 
     class Config:
         schema_extra = {
@@ -65,6 +66,14 @@ class ChatHistoryResponse(BaseModel):
 
 # Utility Functions
 
+def sse_event(data: dict, event: str = None) -> str:
+    """
+    Formats a Server-Sent Events message with a JSON payload.
+    """
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 def get_chat_history_file(document_id: str) -> str:
     """
     Returns the file path for a given document ID's chat history.
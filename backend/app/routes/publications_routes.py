@@ -4,6 +4,7 @@ from typing import List, Optional
 
 from pydantic import BaseModel
 
+from app.concurrency import run_in_pool
 from app.models.publication import Publication
 from app.services.PublicationService import PublicationService  # Assuming the `PublicationService` is in this module
 from app.services.auth_service import verify_token  # Assuming token validation is handled in auth_service
@@ -55,7 +56,7 @@ async def get_publications(
 
         # Fetch publications with pagination
         logging.info(f"Fetching publications for page {page} and per_page {per_page}")
-        publications = publication_service.get_all_publications(page=page, per_page=per_page)
+        publications = await run_in_pool("db", publication_service.get_all_publications, page=page, per_page=per_page)
         return publications
 
     except Exception as e:
@@ -76,7 +77,7 @@ async def get_publication_by_id(
         user_email = get_current_user(token)
 
         # Fetch publication by ID
-        publication = publication_service.get_publication_by_id(publication_id)
+        publication = await run_in_pool("db", publication_service.get_publication_by_id, publication_id)
         if not publication:
             raise HTTPException(status_code=404, detail="Publication not found")
         return publication
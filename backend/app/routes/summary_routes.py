@@ -6,23 +6,24 @@ from fastapi import APIRouter, Depends, Form, HTTPException, Body
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 
 from fastapi import FastAPI, HTTPException, Request, status
 
 from typing import List, Dict
 
 from app import services
+from app.concurrency import run_in_pool
 from app.routes.helpers import ChatResponse, ChatRequest, load_chat_history, setup_chat_histories, \
-    save_chat_history, ChatHistoryResponse, markdown_to_pdf
+    save_chat_history, ChatHistoryResponse, markdown_to_pdf, sse_event
 
 from app.services.database_service import get_db
 from app.services.auth_service import verify_token  # Assuming token validation is handled in auth_service
 import logging
 from fastapi.staticfiles import StaticFiles
 
-from app.services.rag_service import summarize_document, query_chat
-from app.services.report_service import ReportService
+from app.services.rag_service import summarize_document, query_chat, ingest_document, stream_chat, stream_summary
+from app.services import job_queue
 from app.services.tools import tools
 
 # Initialize the router for document routes
@@ -53,7 +54,7 @@ async def summarize_endpoint(
 
         # Extract summary parameters from the request body
         document_name = summary_request.document_name
-        response = summarize_document(document_name)
+        response = await run_in_pool("chat", summarize_document, document_name)
         logging.info(f"Summary response: {response}")
         logging.info("----------------------")
         return {"markdown": response}
@@ -62,17 +63,102 @@ async def summarize_endpoint(
         logging.error(f"An error occurred during the summary process: {str(e)}")
         raise HTTPException(status_code=500, detail=f"An error occurred while summarizing the document: {str(e)}")
 
+
+# Headers that keep proxies (e.g. nginx) from buffering Server-Sent Events
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def sse_stream(deltas, on_complete=None):
+    """
+    Relays answer pieces as "delta" events followed by a "done" event, or an "error" event if the
+    LLM stream fails. on_complete is called with the full answer once the stream has finished.
+    """
+    parts = []
+    try:
+        for delta in deltas:
+            parts.append(delta)
+            yield sse_event({"delta": delta})
+    except Exception as e:
+        logging.error(f"Streaming failed: {str(e)}")
+        yield sse_event({"detail": f"Error generating response: {str(e)}"}, event="error")
+        return
+    if on_complete is not None:
+        on_complete("".join(parts))
+    yield sse_event({}, event="done")
+
+
+@router.post("/summarize/stream", tags=["Summary"])
+async def summarize_stream_endpoint(
+        summary_request: SummaryRequest,
+        token: str = Depends(oauth2_scheme)
+):
+    """
+    Streams a document summary as Server-Sent Events.
+    """
+    user_email = verify_token(token)
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+
+    deltas = await run_in_pool("chat", stream_summary, summary_request.document_name)
+    return StreamingResponse(sse_stream(deltas), media_type="text/event-stream", headers=SSE_HEADERS)
+
+class IngestRequest(BaseModel):
+    document_id: str
+
+
+@router.post("/ingest", tags=["Summary"])
+async def ingest_endpoint(
+        ingest_request: IngestRequest,
+        token: str = Depends(oauth2_scheme)
+):
+    """
+    Endpoint to ingest (parse and embed) a document ahead of chatting with it.
+    """
+    user_email = verify_token(token)
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+
+    etag = await run_in_pool("chat", ingest_document, ingest_request.document_id)
+    return {"document_id": ingest_request.document_id, "etag": etag, "status": "ready"}
+
 class ReportRequest(BaseModel):
     pdf_name: str
-@router.post("/generate_report", response_class=FileResponse, status_code=status.HTTP_200_OK)
+@router.post("/generate_report", status_code=status.HTTP_202_ACCEPTED)
 async def generate_report_endpoint(report_request: ReportRequest):
-    pdf_name = report_request.pdf_name
-    try:
-        report_service = ReportService()
-        report_pdf_path = report_service.generate_report(pdf_name)
-        return FileResponse(report_pdf_path, media_type='application/pdf', filename='report.pdf')
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    """
+    Queues a report generation job and returns its ID. An identical report already queued or
+    running is not queued twice; its job is returned instead.
+    """
+    job, created = await run_in_pool("db", job_queue.enqueue, "report", {"pdf_name": report_request.pdf_name})
+    return {"job_id": job["job_id"], "status": job["status"], "deduplicated": not created}
+
+
+@router.get("/reports/jobs/{job_id}")
+async def report_job_status(job_id: str):
+    """
+    Returns the status ("queued", "running", "succeeded" or "failed"), progress and error of a report job.
+    """
+    job = await run_in_pool("db", job_queue.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {key: job[key] for key in ["job_id", "status", "progress", "message", "error", "params",
+                                      "created_at", "started_at", "finished_at"]}
+
+
+@router.get("/reports/jobs/{job_id}/download", response_class=FileResponse)
+async def report_job_download(job_id: str):
+    """
+    Downloads the PDF produced by a finished report job.
+    """
+    job = await run_in_pool("db", job_queue.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] != job_queue.SUCCEEDED:
+        raise HTTPException(status_code=409, detail=f"Report is not ready (status: {job['status']})")
+    report_pdf_path = job["result"]["report_path"]
+    if not os.path.exists(report_pdf_path):
+        raise HTTPException(status_code=410, detail="Report file is no longer available")
+    return FileResponse(report_pdf_path, media_type='application/pdf', filename='report.pdf')
 setup_chat_histories()
 
 
@@ -86,7 +172,6 @@ async def chat_endpoint(chat_request: ChatRequest, token: str = Depends(oauth2_s
     user_email = verify_token(token)
     if not user_email:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
-    document_id = chat_request.document_id
     user_message = chat_request.message.strip()
 
     if not user_message:
@@ -95,6 +180,17 @@ async def chat_endpoint(chat_request: ChatRequest, token: str = Depends(oauth2_s
             detail="The 'message' field must not be empty."
         )
 
+    # Retrieval, generation and chat history I/O block, so they run on the chat thread pool
+    assistant_entry = await run_in_pool("chat", answer_chat, chat_request, user_message)
+    return ChatResponse(**assistant_entry)
+
+
+def answer_chat(chat_request: ChatRequest, user_message: str) -> dict:
+    """
+    Answers a chat query and persists the exchange to the document's chat history.
+    """
+    document_id = chat_request.document_id
+
     # Load existing chat history
     chat_history = load_chat_history(document_id)
 
@@ -107,7 +203,7 @@ async def chat_endpoint(chat_request: ChatRequest, token: str = Depends(oauth2_s
     chat_history.append(user_entry)
 
     # Generate a dummy Markdown response
-    assistant_response =query_chat(chat_request.document_id, chat_request.message)
+    assistant_response =query_chat(chat_request.document_ids or chat_request.document_id, chat_request.message)
 
     assistant_entry = {
         "role": "assistant",
@@ -118,7 +214,38 @@ async def chat_endpoint(chat_request: ChatRequest, token: str = Depends(oauth2_s
     # Persist the updated chat history
     save_chat_history(document_id, chat_history)
 
-    return ChatResponse(**assistant_entry)
+    return assistant_entry
+
+
+@router.post("/chat/stream", status_code=status.HTTP_200_OK)
+async def chat_stream_endpoint(chat_request: ChatRequest, token: str = Depends(oauth2_scheme)):
+    """
+    Streams the answer to a chat query as Server-Sent Events ("delta" events, then "done").
+    The conversation is persisted once the answer is complete.
+    """
+    user_email = verify_token(token)
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    document_id = chat_request.document_id
+    user_message = chat_request.message.strip()
+
+    if not user_message:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="The 'message' field must not be empty."
+        )
+
+    deltas = await run_in_pool("chat", stream_chat, chat_request.document_ids or chat_request.document_id,
+                               chat_request.message)
+
+    def save_conversation(assistant_response: str):
+        chat_history = load_chat_history(document_id)
+        chat_history.append({"role": "user", "content": user_message})
+        chat_history.append({"role": "assistant", "content": assistant_response})
+        save_chat_history(document_id, chat_history)
+
+    return StreamingResponse(sse_stream(deltas, on_complete=save_conversation),
+                             media_type="text/event-stream", headers=SSE_HEADERS)
 
 notes_dir = os.getcwd() + "/notes/assignment3/pdfs/"
 chat_histories_dir = os.getcwd() + "/chat_histories/assignment3/pdfs/"
@@ -156,11 +283,11 @@ async def download_file(request:dict):
     logging.info(f"Downloading file: {request["filename"]}")
     json_file = chat_histories_dir + request["filename"] + "_chat.json"
     print(json_file)
-    json_extract = read_json(json_file)
+    json_extract = await run_in_pool("chat", read_json, json_file)
     query = "-----Below is a chat history of the document. I want you to create a well formatted markdown of this. Dont repeat any questions if occuring twice-----\n" + json_extract
-    assistant_response = query_chat("assignment3/pdfs/" + request['filename'], query)
+    assistant_response = await run_in_pool("chat", query_chat, "assignment3/pdfs/" + request['filename'], query)
     print(assistant_response)
-    markdown_to_pdf(assistant_response, notes_dir +  request['filename'])
+    await run_in_pool("report", markdown_to_pdf, assistant_response, notes_dir +  request['filename'])
     file_path = Path(notes_dir + request["filename"] + ".pdf")
     # Check if file exists and is a PDF
     if not file_path.exists() or not file_path.is_file() or file_path.suffix.lower() != '.pdf':
@@ -0,0 +1,87 @@
+# app/services/answer_cache.py
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from typing import List, Optional
+
+import numpy as np
+
+from app.cache import LRUCache, content_hash, normalize_text
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "4096"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(24 * 60 * 60)))
+# Cosine similarity above which a differently worded question reuses a cached answer; unset disables it
+ANSWER_CACHE_SIMILARITY_THRESHOLD = os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD")
+# Question embeddings kept per document for near-duplicate matching
+ANSWER_CACHE_SIMILAR_PER_DOCUMENT = int(os.getenv("ANSWER_CACHE_SIMILAR_PER_DOCUMENT", "256"))
+
+
+class AnswerCache:
+    """
+    Caches generated answers keyed by document ID, the IDs of the retrieved chunks and the
+    normalized question. Optionally, a question whose embedding is close enough to a cached
+    question with the same retrieved chunks reuses that answer. Entries expire after
+    ttl_seconds and are dropped when their document is re-ingested.
+    """
+
+    def __init__(self, max_entries: int = ANSWER_CACHE_SIZE, ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS,
+                 similarity_threshold: Optional[float] = None,
+                 similar_per_document: int = ANSWER_CACHE_SIMILAR_PER_DOCUMENT):
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._answers = LRUCache(max_entries, ttl_seconds=ttl_seconds)
+        self._generations = defaultdict(int)
+        self._similar = defaultdict(lambda: deque(maxlen=similar_per_document))
+        self._lock = threading.Lock()
+
+    def _key(self, document_id: str, chunk_ids: List[str], question: str) -> str:
+        with self._lock:
+            generation = self._generations[document_id]
+        return content_hash(document_id, str(generation), ",".join(sorted(chunk_ids)), normalize_text(question))
+
+    def get(self, document_id: str, chunk_ids: List[str], question: str, question_embedding=None) -> Optional[str]:
+        answer = self._answers.get(self._key(document_id, chunk_ids, question))
+        if answer is not None or self.similarity_threshold is None or question_embedding is None:
+            return answer
+
+        chunks_key = ",".join(sorted(chunk_ids))
+        query = np.asarray(question_embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        now = time.monotonic()
+        with self._lock:
+            candidates = [(embedding, cached_answer) for embedding, cached_chunks_key, cached_answer, stored_at
+                          in self._similar[document_id]
+                          if cached_chunks_key == chunks_key and now - stored_at < self.ttl_seconds]
+        if not candidates:
+            return None
+        similarities = np.stack([embedding for embedding, _ in candidates]) @ query
+        best = int(np.argmax(similarities))
+        if similarities[best] >= self.similarity_threshold:
+            return candidates[best][1]
+        return None
+
+    def set(self, document_id: str, chunk_ids: List[str], question: str, answer: str, question_embedding=None):
+        self._answers.set(self._key(document_id, chunk_ids, question), answer)
+        if self.similarity_threshold is None or question_embedding is None:
+            return
+        embedding = np.asarray(question_embedding, dtype=np.float32)
+        embedding /= np.linalg.norm(embedding) or 1.0
+        with self._lock:
+            self._similar[document_id].append((embedding, ",".join(sorted(chunk_ids)), answer, time.monotonic()))
+
+    def invalidate(self, document_id: str):
+        """
+        Drops every cached answer of a document, e.g. after it was re-ingested.
+        """
+        with self._lock:
+            self._generations[document_id] += 1
+            self._similar.pop(document_id, None)
+
+    def stats(self) -> dict:
+        return self._answers.stats()
+
+
+answer_cache = AnswerCache(
+    similarity_threshold=float(ANSWER_CACHE_SIMILARITY_THRESHOLD) if ANSWER_CACHE_SIMILARITY_THRESHOLD else None
+)
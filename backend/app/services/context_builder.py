@@ -0,0 +1,102 @@
+# app/services/context_builder.py
+import os
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List
+
+import tiktoken
+
+from app.cache import normalize_text
+from app.services.vector_store import VectorMatch
+
+# Maximum number of prompt tokens spent on retrieved context
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+# Model whose tokenizer is used to count context tokens
+CONTEXT_TOKENIZER_MODEL = os.getenv("CONTEXT_TOKENIZER_MODEL", "gpt-3.5-turbo")
+# Chunks whose word shingles overlap at least this much with an already selected chunk are dropped
+CONTEXT_DUPLICATE_THRESHOLD = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.8"))
+# A chunk is only cut to fit the remaining budget if at least this many tokens are left
+CONTEXT_MIN_CHUNK_TOKENS = int(os.getenv("CONTEXT_MIN_CHUNK_TOKENS", "64"))
+
+_SHINGLE_SIZE = 5
+_SEPARATOR = "\n\n"
+
+
+@dataclass
+class Context:
+    text: str
+    tokens: int
+    chunks: int
+    duplicates: int
+    truncated: int
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str = CONTEXT_TOKENIZER_MODEL) -> tiktoken.Encoding:
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def _shingles(text: str) -> set:
+    words = re.findall(r"\w+", normalize_text(text))
+    if len(words) < _SHINGLE_SIZE:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + _SHINGLE_SIZE]) for i in range(len(words) - _SHINGLE_SIZE + 1)}
+
+
+def _is_duplicate(shingles: set, selected: List[set]) -> bool:
+    # Containment rather than Jaccard, so a table caption repeated inside a page's text also counts
+    for other in selected:
+        overlap = len(shingles & other)
+        if overlap and overlap / min(len(shingles), len(other)) >= CONTEXT_DUPLICATE_THRESHOLD:
+            return True
+    return False
+
+
+def build_context(matches: List[VectorMatch], token_budget: int = CONTEXT_TOKEN_BUDGET) -> Context:
+    """
+    Assembles the LLM context from ranked matches: near-identical chunks are dropped, the most
+    relevant chunks are kept until token_budget is reached (cutting the last one to fit), and the
+    selection is put back into document and page order.
+    """
+    encoding = get_encoding()
+    separator_tokens = len(encoding.encode(_SEPARATOR))
+    selected = []
+    selected_shingles = []
+    used = 0
+    duplicates = 0
+    truncated = 0
+
+    for match in matches:
+        text = match.metadata.get("text", "").strip()
+        if not text:
+            continue
+        shingles = _shingles(text)
+        if _is_duplicate(shingles, selected_shingles):
+            duplicates += 1
+            continue
+
+        remaining = token_budget - used - (separator_tokens if selected else 0)
+        tokens = encoding.encode(text)
+        if len(tokens) > remaining:
+            if remaining < CONTEXT_MIN_CHUNK_TOKENS:
+                break
+            text = encoding.decode(tokens[:remaining])
+            tokens = tokens[:remaining]
+            truncated += 1
+
+        used += len(tokens) + (separator_tokens if selected else 0)
+        selected.append((match, text))
+        selected_shingles.append(shingles)
+
+    selected.sort(key=lambda item: (item[0].metadata.get("document_id", ""), item[0].metadata.get("page_num") or 0))
+    return Context(
+        text=_SEPARATOR.join(text for _, text in selected),
+        tokens=used,
+        chunks=len(selected),
+        duplicates=duplicates,
+        truncated=truncated
+    )
@@ -0,0 +1,92 @@
+# app/services/document_registry.py
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from fastapi import HTTPException
+
+from app.services import manifest_store
+
+# How long an in-memory "ready" flag is trusted before the S3 ETag is checked again
+READY_CACHE_TTL_SECONDS = int(os.getenv("READY_CACHE_TTL_SECONDS", "300"))
+# How often a worker waiting on another worker's ingestion re-checks the manifest
+INGEST_POLL_SECONDS = float(os.getenv("INGEST_POLL_SECONDS", "2"))
+# Longest time a request waits for another thread or worker to finish ingesting the same document
+INGEST_WAIT_SECONDS = float(os.getenv("INGEST_WAIT_SECONDS", "60"))
+
+# Identifies this process when claiming documents for ingestion
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+_ready_cache = {}
+_ready_cache_lock = threading.Lock()
+_ingest_locks = {}
+_ingest_locks_guard = threading.Lock()
+
+
+def is_ready(document_id: str) -> bool:
+    """
+    Returns True if the document was confirmed ingested within READY_CACHE_TTL_SECONDS.
+    This is the only check made on the chat hot path.
+    """
+    with _ready_cache_lock:
+        entry = _ready_cache.get(document_id)
+    if entry is None:
+        return False
+    _, checked_at = entry
+    return time.monotonic() - checked_at < READY_CACHE_TTL_SECONDS
+
+
+def is_ingested(document_id: str, etag: str) -> bool:
+    """
+    Returns True if this exact version (S3 key + ETag) of the document has been ingested.
+    """
+    return manifest_store.get_document_etag(document_id) == etag
+
+
+def mark_ready(document_id: str, etag: str, persist: bool = False):
+    """
+    Flags a document version as ready for retrieval, optionally persisting it for other workers.
+    """
+    if persist:
+        manifest_store.set_document_etag(document_id, etag)
+    with _ready_cache_lock:
+        _ready_cache[document_id] = (etag, time.monotonic())
+
+
+def invalidate(document_id: str):
+    """
+    Drops a document from the registry so that the next request re-ingests it.
+    """
+    with _ready_cache_lock:
+        _ready_cache.pop(document_id, None)
+    manifest_store.set_document_etag(document_id, None)
+
+
+@contextmanager
+def ingest_lock(document_id: str, etag: str = None, timeout: float = INGEST_WAIT_SECONDS):
+    """
+    Serializes ingestion of a single document: threads of this worker share a lock, and other
+    uvicorn workers are kept out by a claim in the manifest database. Waits up to timeout seconds
+    while another thread or worker is ingesting it, then gives up with a 503. Not reentrant.
+    """
+    deadline = time.monotonic() + timeout
+    with _ingest_locks_guard:
+        lock = _ingest_locks.setdefault(document_id, threading.Lock())
+    if not lock.acquire(timeout=timeout):
+        raise HTTPException(status_code=503, detail=f"Document {document_id} is being ingested, retry shortly.")
+    try:
+        while not manifest_store.claim_ingest(document_id, etag, WORKER_ID):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise HTTPException(status_code=503,
+                                    detail=f"Document {document_id} is being ingested, retry shortly.")
+            time.sleep(min(INGEST_POLL_SECONDS, remaining))
+        try:
+            yield
+        finally:
+            manifest_store.release_ingest(document_id, WORKER_ID)
+    finally:
+        lock.release()
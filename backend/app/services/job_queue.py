@@ -0,0 +1,257 @@
+# app/services/job_queue.py
+import importlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+
+from app.cache import content_hash
+
+# Durable job queue shared by every API and worker process on the host
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join(os.getcwd(), "index_histories", "jobs.db"))
+# Worker threads started per process; set RUN_JOB_WORKERS=false to run them only in separate
+# worker processes (python -m app.services.job_queue)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+RUN_JOB_WORKERS = os.getenv("RUN_JOB_WORKERS", "true").lower() == "true"
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+# A running job whose worker has not sent a heartbeat for this long is handed to another worker
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+# Longest time stop_workers waits for running jobs on shutdown
+JOB_SHUTDOWN_SECONDS = float(os.getenv("JOB_SHUTDOWN_SECONDS", "5"))
+
+# Job kind -> "module:function" handler, called as handler(params, progress) and returning a
+# JSON-serializable result. progress(fraction, message) records how far the job has got.
+HANDLERS = {
+    "report": "app.services.report_service:run_report_job",
+}
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    dedupe_key TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    result TEXT,
+    error TEXT,
+    worker TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    heartbeat_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, created_at);
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_in_flight ON jobs (dedupe_key) WHERE status IN ('queued', 'running');
+"""
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = set()
+_workers = []
+_stop_event = threading.Event()
+
+
+def get_connection() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        return conn
+
+    os.makedirs(os.path.dirname(JOBS_DB_PATH), exist_ok=True)
+    conn = sqlite3.connect(JOBS_DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    with _schema_lock:
+        if JOBS_DB_PATH not in _schema_ready:
+            conn.executescript(_SCHEMA)
+            _schema_ready.add(JOBS_DB_PATH)
+    _local.conn = conn
+    return conn
+
+
+@contextmanager
+def transaction():
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _to_dict(row: sqlite3.Row) -> Dict:
+    job = dict(row)
+    job["params"] = json.loads(job["params"])
+    job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+    job.pop("dedupe_key", None)
+    return job
+
+
+def enqueue(kind: str, params: Dict) -> Tuple[Dict, bool]:
+    """
+    Queues a job and returns (job, created). If an identical job (same kind and params) is
+    already queued or running, that job is returned instead and created is False.
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    params_json = json.dumps(params, sort_keys=True)
+    dedupe_key = content_hash(kind, params_json)
+    with transaction() as conn:
+        row = conn.execute(
+            "SELECT * FROM jobs WHERE dedupe_key = ? AND status IN (?, ?)", (dedupe_key, QUEUED, RUNNING)
+        ).fetchone()
+        if row:
+            return _to_dict(row), False
+        job_id = uuid.uuid4().hex
+        conn.execute(
+            "INSERT INTO jobs (job_id, kind, params, dedupe_key, status, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, kind, params_json, dedupe_key, QUEUED, time.time())
+        )
+        row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+    logging.info(f"Queued {kind} job {job_id}")
+    return _to_dict(row), True
+
+
+def get_job(job_id: str) -> Optional[Dict]:
+    row = get_connection().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+    return _to_dict(row) if row else None
+
+
+def claim_next(worker: str) -> Optional[Dict]:
+    """
+    Hands the oldest queued job to a worker. Running jobs whose lease expired are requeued first.
+    """
+    now = time.time()
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE jobs SET status = ?, worker = NULL WHERE status = ? AND heartbeat_at < ?",
+            (QUEUED, RUNNING, now - JOB_LEASE_SECONDS)
+        )
+        row = conn.execute(
+            "SELECT job_id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = ?, worker = ?, started_at = ?, heartbeat_at = ? WHERE job_id = ?",
+            (RUNNING, worker, now, now, row["job_id"])
+        )
+        row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (row["job_id"],)).fetchone()
+    return _to_dict(row)
+
+
+def update_progress(job_id: str, worker: str, progress: float = None, message: str = None):
+    """
+    Records progress and renews the worker's lease on a running job.
+    """
+    with transaction() as conn:
+        conn.execute(
+            """
+            UPDATE jobs SET progress = COALESCE(?, progress), message = COALESCE(?, message), heartbeat_at = ?
+            WHERE job_id = ? AND worker = ? AND status = ?
+            """,
+            (progress, message, time.time(), job_id, worker, RUNNING)
+        )
+
+
+def finish(job_id: str, worker: str, result=None, error: str = None):
+    with transaction() as conn:
+        conn.execute(
+            """
+            UPDATE jobs SET status = ?, progress = CASE WHEN ? IS NULL THEN 1 ELSE progress END,
+                result = ?, error = ?, finished_at = ?
+            WHERE job_id = ? AND worker = ?
+            """,
+            (FAILED if error else SUCCEEDED, error, json.dumps(result) if result is not None else None, error,
+             time.time(), job_id, worker)
+        )
+
+
+def _resolve_handler(kind: str) -> Callable:
+    module_name, function_name = HANDLERS[kind].split(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def run_job(job: Dict, worker: str):
+    """
+    Runs a claimed job, renewing its lease in the background until the handler returns.
+    """
+    job_id = job["job_id"]
+    done = threading.Event()
+
+    def heartbeat():
+        while not done.wait(JOB_LEASE_SECONDS / 3):
+            update_progress(job_id, worker)
+
+    threading.Thread(target=heartbeat, name=f"job-heartbeat-{job_id[:8]}", daemon=True).start()
+    try:
+        handler = _resolve_handler(job["kind"])
+        result = handler(job["params"], lambda progress, message=None: update_progress(job_id, worker, progress, message))
+        finish(job_id, worker, result=result)
+        logging.info(f"{job['kind']} job {job_id} succeeded")
+    except Exception as e:
+        logging.error(f"{job['kind']} job {job_id} failed: {str(e)}")
+        finish(job_id, worker, error=getattr(e, "detail", None) or str(e))
+    finally:
+        done.set()
+
+
+def _worker_loop(worker: str):
+    while not _stop_event.is_set():
+        try:
+            job = claim_next(worker)
+        except sqlite3.Error as e:
+            logging.warning(f"[WARN] Could not claim a job: {e}")
+            job = None
+        if job is None:
+            _stop_event.wait(JOB_POLL_SECONDS)
+            continue
+        run_job(job, worker)
+
+
+def start_workers(count: int = JOB_WORKERS):
+    """
+    Starts count worker threads in this process; together they run at most count jobs at a time.
+    """
+    _stop_event.clear()
+    for n in range(count):
+        worker = f"{socket.gethostname()}-{os.getpid()}-{n}"
+        thread = threading.Thread(target=_worker_loop, args=(worker,), name=f"job-worker-{n}", daemon=True)
+        thread.start()
+        _workers.append(thread)
+    logging.info(f"Started {count} job workers")
+
+
+def stop_workers(timeout: float = JOB_SHUTDOWN_SECONDS):
+    """
+    Stops the worker threads after their current job, waiting at most timeout seconds in total.
+    Jobs left running are picked up again by another worker once their lease expires.
+    """
+    _stop_event.set()
+    deadline = time.monotonic() + timeout
+    for thread in _workers:
+        thread.join(max(0.0, deadline - time.monotonic()))
+    _workers.clear()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    start_workers()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stop_workers()
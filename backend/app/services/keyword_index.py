@@ -0,0 +1,264 @@
+# app/services/keyword_index.py
+import heapq
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Set, Tuple
+
+from app.services.vector_store import VectorMatch
+
+# One SQLite database per vector index holds its BM25 keyword index
+KEYWORD_INDEX_DIR = os.getenv("KEYWORD_INDEX_DIR", os.path.join(os.getcwd(), "index_histories", "keyword_index"))
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+# Words, numbers and figures such as "3.5%", "1,200" or "s&p" are kept as single tokens
+_TOKEN_PATTERN = re.compile(r"\w+(?:[.,&/'-]\w+)*%?")
+_STOPWORDS = frozenset("""
+a an and are as at be but by for from has have if in into is it its of on or such that the their then there
+these they this to was were will with what which who how do does did not no can i you we our your
+""".split())
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_key INTEGER PRIMARY KEY,
+    document_id TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS chunks (
+    chunk_id INTEGER PRIMARY KEY,
+    doc_key INTEGER NOT NULL,
+    vector_id TEXT NOT NULL UNIQUE,
+    page_num INTEGER,
+    length INTEGER NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chunks_by_document ON chunks (doc_key);
+
+CREATE TABLE IF NOT EXISTS terms (
+    term_id INTEGER PRIMARY KEY,
+    term TEXT NOT NULL UNIQUE,
+    df INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS postings (
+    term_id INTEGER NOT NULL,
+    doc_key INTEGER NOT NULL,
+    chunk_id INTEGER NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (term_id, doc_key, chunk_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_by_chunk ON postings (chunk_id);
+
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO stats (name, value) VALUES ('chunk_count', 0), ('total_length', 0);
+"""
+
+_local = threading.local()
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits text into lower-cased keyword tokens, dropping common English stopwords.
+    """
+    return [token for token in _TOKEN_PATTERN.findall(text.casefold()) if token not in _STOPWORDS]
+
+
+def get_connection(index_name: str) -> sqlite3.Connection:
+    """
+    Returns this thread's connection to the keyword index of a vector index, creating it on first use.
+    """
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(index_name)
+    if conn is not None:
+        return conn
+
+    os.makedirs(KEYWORD_INDEX_DIR, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(KEYWORD_INDEX_DIR, f"{index_name}.db"), timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    conn.executescript(_SCHEMA)
+    connections[index_name] = conn
+    return conn
+
+
+@contextmanager
+def transaction(index_name: str):
+    conn = get_connection(index_name)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _doc_key(conn: sqlite3.Connection, document_id: str) -> int:
+    conn.execute("INSERT OR IGNORE INTO documents (document_id) VALUES (?)", (document_id,))
+    return conn.execute("SELECT doc_key FROM documents WHERE document_id = ?", (document_id,)).fetchone()[0]
+
+
+def _delete_chunks(conn: sqlite3.Connection, vector_ids: List[str]):
+    chunk_ids = []
+    removed_length = 0
+    for vector_id in vector_ids:
+        row = conn.execute("SELECT chunk_id, length FROM chunks WHERE vector_id = ?", (vector_id,)).fetchone()
+        if row:
+            chunk_ids.append(row[0])
+            removed_length += row[1]
+    if not chunk_ids:
+        return
+
+    df_deltas = Counter()
+    for chunk_id in chunk_ids:
+        df_deltas.update(term_id for term_id, in conn.execute(
+            "SELECT term_id FROM postings WHERE chunk_id = ?", (chunk_id,)
+        ))
+    conn.executemany("UPDATE terms SET df = df - ? WHERE term_id = ?",
+                     [(delta, term_id) for term_id, delta in df_deltas.items()])
+    conn.executemany("DELETE FROM postings WHERE chunk_id = ?", [(chunk_id,) for chunk_id in chunk_ids])
+    conn.executemany("DELETE FROM chunks WHERE chunk_id = ?", [(chunk_id,) for chunk_id in chunk_ids])
+    conn.execute("UPDATE stats SET value = value - ? WHERE name = 'chunk_count'", (len(chunk_ids),))
+    conn.execute("UPDATE stats SET value = value - ? WHERE name = 'total_length'", (removed_length,))
+
+
+def add_chunks(index_name: str, document_id: str, chunks: Iterable[Tuple[str, int, str]]):
+    """
+    Indexes (vector ID, page number, text) chunks of a document. A chunk whose vector ID is
+    already indexed is replaced.
+    """
+    chunks = list(chunks)
+    if not chunks:
+        return
+    with transaction(index_name) as conn:
+        _delete_chunks(conn, [vector_id for vector_id, _, _ in chunks])
+        doc_key = _doc_key(conn, document_id)
+
+        postings = []
+        df_deltas = Counter()
+        total_length = 0
+        for vector_id, page_num, text in chunks:
+            tokens = tokenize(text)
+            total_length += len(tokens)
+            chunk_id = conn.execute(
+                "INSERT INTO chunks (doc_key, vector_id, page_num, length, text) VALUES (?, ?, ?, ?, ?)",
+                (doc_key, vector_id, page_num, len(tokens), text)
+            ).lastrowid
+            term_counts = Counter(tokens)
+            df_deltas.update(term_counts.keys())
+            postings.append((chunk_id, term_counts))
+
+        term_ids = {}
+        for term, delta in df_deltas.items():
+            term_ids[term] = conn.execute(
+                """
+                INSERT INTO terms (term, df) VALUES (?, ?)
+                ON CONFLICT (term) DO UPDATE SET df = df + excluded.df
+                RETURNING term_id
+                """,
+                (term, delta)
+            ).fetchone()[0]
+        conn.executemany(
+            "INSERT INTO postings (term_id, doc_key, chunk_id, tf) VALUES (?, ?, ?, ?)",
+            [(term_ids[term], doc_key, chunk_id, tf)
+             for chunk_id, term_counts in postings for term, tf in term_counts.items()]
+        )
+        conn.execute("UPDATE stats SET value = value + ? WHERE name = 'chunk_count'", (len(chunks),))
+        conn.execute("UPDATE stats SET value = value + ? WHERE name = 'total_length'", (total_length,))
+
+
+def delete_chunks(index_name: str, vector_ids: Iterable[str]):
+    """
+    Removes chunks from the keyword index by vector ID.
+    """
+    vector_ids = list(vector_ids)
+    if not vector_ids:
+        return
+    with transaction(index_name) as conn:
+        _delete_chunks(conn, vector_ids)
+
+
+def indexed_vector_ids(index_name: str, document_id: str) -> Set[str]:
+    """
+    Returns the vector IDs of a document's chunks present in the keyword index.
+    """
+    rows = get_connection(index_name).execute(
+        "SELECT vector_id FROM chunks JOIN documents USING (doc_key) WHERE document_id = ?", (document_id,)
+    )
+    return {vector_id for vector_id, in rows}
+
+
+def search(index_name: str, query: str, document_ids: List[str], top_k: int) -> List[VectorMatch]:
+    """
+    Ranks the chunks of the given documents against the query with BM25. Matches carry the same
+    metadata as the vector store's (text, page_num, document_id).
+    """
+    terms = set(tokenize(query))
+    if not terms or top_k <= 0:
+        return []
+    conn = get_connection(index_name)
+
+    doc_keys = {doc_key: document_id for doc_key, document_id in conn.execute(
+        f"SELECT doc_key, document_id FROM documents WHERE document_id IN ({','.join('?' * len(document_ids))})",
+        document_ids
+    )}
+    if not doc_keys:
+        return []
+    stats = dict(conn.execute("SELECT name, value FROM stats"))
+    chunk_count = stats["chunk_count"]
+    if chunk_count <= 0:
+        return []
+    avg_length = stats["total_length"] / chunk_count
+
+    term_rows = conn.execute(
+        f"SELECT term_id, df FROM terms WHERE term IN ({','.join('?' * len(terms))}) AND df > 0", list(terms)
+    ).fetchall()
+    doc_placeholders = ",".join("?" * len(doc_keys))
+    term_postings = []
+    for term_id, df in term_rows:
+        idf = math.log(1 + (chunk_count - df + 0.5) / (df + 0.5))
+        rows = conn.execute(
+            f"SELECT chunk_id, tf FROM postings WHERE term_id = ? AND doc_key IN ({doc_placeholders})",
+            [term_id, *doc_keys]
+        ).fetchall()
+        term_postings.append((idf, rows))
+
+    candidates = {chunk_id for _, rows in term_postings for chunk_id, _ in rows}
+    if not candidates:
+        return []
+    lengths = {}
+    candidate_list = list(candidates)
+    for start in range(0, len(candidate_list), 500):
+        batch = candidate_list[start:start + 500]
+        lengths.update(conn.execute(
+            f"SELECT chunk_id, length FROM chunks WHERE chunk_id IN ({','.join('?' * len(batch))})", batch
+        ))
+
+    scores = Counter()
+    for idf, rows in term_postings:
+        for chunk_id, tf in rows:
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[chunk_id] / avg_length)
+            scores[chunk_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+    matches = []
+    for chunk_id, score in heapq.nlargest(top_k, scores.items(), key=lambda item: item[1]):
+        vector_id, doc_key, page_num, text = conn.execute(
+            "SELECT vector_id, doc_key, page_num, text FROM chunks WHERE chunk_id = ?", (chunk_id,)
+        ).fetchone()
+        matches.append(VectorMatch(vector_id, score, {
+            "text": text,
+            "page_num": page_num,
+            "document_id": doc_keys[doc_key]
+        }))
+    return matches
@@ -0,0 +1,196 @@
+# app/services/manifest_store.py
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional, Tuple
+
+# Single SQLite database holding ingestion state for every document and vector index
+MANIFEST_DB_PATH = os.getenv("MANIFEST_DB_PATH", os.path.join(os.getcwd(), "index_histories", "manifest.db"))
+# An ingestion claim older than this is considered abandoned (e.g. the worker died)
+INGEST_LEASE_SECONDS = int(os.getenv("INGEST_LEASE_SECONDS", "1800"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    index_name TEXT NOT NULL,
+    document_id TEXT NOT NULL,
+    chunk_key TEXT NOT NULL,
+    page_num INTEGER,
+    content_hash TEXT NOT NULL,
+    vector_id TEXT NOT NULL,
+    PRIMARY KEY (index_name, document_id, chunk_key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS chunks_by_page ON chunks (index_name, document_id, page_num);
+CREATE INDEX IF NOT EXISTS chunks_by_hash ON chunks (content_hash);
+
+CREATE TABLE IF NOT EXISTS documents (
+    document_id TEXT PRIMARY KEY,
+    etag TEXT,
+    ingesting_etag TEXT,
+    ingest_owner TEXT,
+    ingest_started_at REAL,
+    updated_at REAL
+);
+"""
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = set()
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Returns this thread's connection to the manifest database, creating the schema on first use.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        return conn
+
+    os.makedirs(os.path.dirname(MANIFEST_DB_PATH), exist_ok=True)
+    conn = sqlite3.connect(MANIFEST_DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    with _schema_lock:
+        if MANIFEST_DB_PATH not in _schema_ready:
+            conn.executescript(_SCHEMA)
+            _schema_ready.add(MANIFEST_DB_PATH)
+    _local.conn = conn
+    return conn
+
+
+@contextmanager
+def transaction():
+    """
+    Runs a write transaction, taking the database write lock up front so concurrent
+    writers (threads or uvicorn workers) queue instead of failing mid-transaction.
+    """
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+# Chunks
+
+def load_chunks(document_id: str, index_name: str) -> Dict[str, Dict]:
+    """
+    Loads the chunk manifest of a document as {chunk key: {"id", "hash", "page_num"}}.
+    """
+    rows = get_connection().execute(
+        "SELECT chunk_key, vector_id, content_hash, page_num FROM chunks WHERE index_name = ? AND document_id = ?",
+        (index_name, document_id)
+    ).fetchall()
+    return {row["chunk_key"]: {"id": row["vector_id"], "hash": row["content_hash"], "page_num": row["page_num"]}
+            for row in rows}
+
+
+def upsert_chunks(document_id: str, index_name: str, chunks: Iterable[Tuple[str, Dict]]):
+    """
+    Bulk inserts or updates (chunk key, {"id", "hash", "page_num"}) entries in a single transaction.
+    """
+    rows = [(index_name, document_id, key, entry["page_num"], entry["hash"], entry["id"]) for key, entry in chunks]
+    if not rows:
+        return
+    with transaction() as conn:
+        conn.executemany(
+            """
+            INSERT INTO chunks (index_name, document_id, chunk_key, page_num, content_hash, vector_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (index_name, document_id, chunk_key) DO UPDATE SET
+                page_num = excluded.page_num,
+                content_hash = excluded.content_hash,
+                vector_id = excluded.vector_id
+            """,
+            rows
+        )
+
+
+def delete_chunks(document_id: str, index_name: str, chunk_keys: Iterable[str]):
+    """
+    Removes chunks from a document's manifest.
+    """
+    rows = [(index_name, document_id, key) for key in chunk_keys]
+    if not rows:
+        return
+    with transaction() as conn:
+        conn.executemany("DELETE FROM chunks WHERE index_name = ? AND document_id = ? AND chunk_key = ?", rows)
+
+
+# Documents
+
+def get_document_etag(document_id: str) -> Optional[str]:
+    """
+    Returns the S3 ETag of the last fully ingested version of a document.
+    """
+    row = get_connection().execute("SELECT etag FROM documents WHERE document_id = ?", (document_id,)).fetchone()
+    return row["etag"] if row else None
+
+
+def set_document_etag(document_id: str, etag: Optional[str]):
+    """
+    Records (or clears, with etag=None) the fully ingested version of a document and releases its ingestion claim.
+    """
+    with transaction() as conn:
+        conn.execute(
+            """
+            INSERT INTO documents (document_id, etag, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT (document_id) DO UPDATE SET
+                etag = excluded.etag,
+                ingesting_etag = NULL,
+                ingest_owner = NULL,
+                ingest_started_at = NULL,
+                updated_at = excluded.updated_at
+            """,
+            (document_id, etag, time.time())
+        )
+
+
+def claim_ingest(document_id: str, etag: str, owner: str) -> bool:
+    """
+    Atomically claims the right to ingest a document version. Returns False while another
+    owner holds an unexpired claim, so two workers never ingest the same document at once.
+    """
+    now = time.time()
+    with transaction() as conn:
+        row = conn.execute(
+            "SELECT ingest_owner, ingest_started_at FROM documents WHERE document_id = ?", (document_id,)
+        ).fetchone()
+        if row and row["ingest_owner"] and row["ingest_owner"] != owner \
+                and now - row["ingest_started_at"] < INGEST_LEASE_SECONDS:
+            return False
+        conn.execute(
+            """
+            INSERT INTO documents (document_id, ingesting_etag, ingest_owner, ingest_started_at, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (document_id) DO UPDATE SET
+                ingesting_etag = excluded.ingesting_etag,
+                ingest_owner = excluded.ingest_owner,
+                ingest_started_at = excluded.ingest_started_at,
+                updated_at = excluded.updated_at
+            """,
+            (document_id, etag, owner, now, now)
+        )
+    return True
+
+
+def release_ingest(document_id: str, owner: str):
+    """
+    Releases an ingestion claim without recording a new version (e.g. after a failure).
+    """
+    with transaction() as conn:
+        conn.execute(
+            """
+            UPDATE documents SET ingesting_etag = NULL, ingest_owner = NULL, ingest_started_at = NULL
+            WHERE document_id = ? AND ingest_owner = ?
+            """,
+            (document_id, owner)
+        )
+    logging.info(f"Released ingestion claim on {document_id}")
@@ -1,21 +1,24 @@
 # app/services/pinecone_service.py
-import json
 import logging
 
 import dotenv
 import pinecone
 import os
-from typing import List, Dict
-import uuid
+from typing import List, Dict, Iterable
 from fastapi import HTTPException
 from pinecone import Pinecone, ServerlessSpec
 
-from app.utils import embed_model
+from app.cache import content_hash
+from app.services import keyword_index, manifest_store
+from app.services.vector_store import VectorStore
+from app.utils import embed_model, EMBED_BATCH_SIZE
 from app.utils import load_chat_history, save_chat_history
 
 dotenv.load_dotenv()
-print(os.getenv("PINECONE_API_KEY"))
-pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+
+# Number of vectors sent per upsert request
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "200"))
+
 # Initialize Pinecone
 def initialize_pinecone():
     PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
@@ -59,12 +62,81 @@ def setup_pinecone_index(index_name: str, embedding_dimension: int, pinecone) ->
         raise HTTPException(status_code=500, detail=f"Error setting up Pinecone index: {str(e)}")
 
 
-def store_in_pinecone(index: pinecone.Index, parsed_data: List[Dict], stored_pages: set, document_id: str):
+def chunk_key(pdf_name: str, page_num) -> str:
+    """
+    Identifies a chunk within a document by its source name and page number.
+    """
+    return f"{pdf_name}|{page_num}"
+
+
+def make_vector_id(document_id: str, key: str, text_hash: str) -> str:
     """
-    Stores parsed PDF data in Pinecone, checking if each page has already been stored based on pdf_name and page_num.
+    Builds a stable, ASCII-only vector ID from the document ID, chunk source and chunk content hash,
+    so re-ingesting unchanged content produces the same ID instead of a duplicate vector.
+    """
+    return f"{content_hash(document_id, key)[:24]}-{text_hash[:16]}"
+
+
+def store_in_pinecone(index: VectorStore, parsed_data: Iterable[Dict], manifest: Dict[str, Dict], document_id: str,
+                      index_name: str, embed_batch_size: int = EMBED_BATCH_SIZE, upsert_batch_size: int = UPSERT_BATCH_SIZE,
+                      failures: List[str] = None) -> int:
+    """
+    Stores parsed PDF data in a vector store (Pinecone or local) incrementally. Each chunk's content hash is compared with the
+    document's manifest: unchanged chunks are skipped, new or changed chunks are embedded in batches of
+    embed_batch_size and upserted in chunks of upsert_batch_size. The previous vector of a changed chunk
+    is deleted once its replacement is stored, and vectors of chunks that no longer exist are deleted
+    after the whole document has been processed. The BM25 keyword index is updated alongside.
+
+    failures collects the parts of the document the parser had to skip (filled in while parsed_data
+    is consumed). If there are any, or if nothing was parsed at all, stale vectors are kept: a chunk
+    missing from an incomplete pass is not known to be gone. Returns the number of chunks seen.
     """
     print("[INFO] Storing parsed data in Pinecone.")
 
+    pending = []
+    seen_keys = set()
+    # Unchanged chunks missing from the keyword index (e.g. ingested before it existed) are added to it
+    keyword_ids = keyword_index.indexed_vector_ids(index_name, document_id)
+    keyword_backfill = []
+
+    def flush():
+        texts = [page_text for _, _, _, page_text, _ in pending]
+        embeddings = embed_model.get_text_embedding_batch(texts)
+
+        vectors = []
+        stored = []
+        for (key, vector_id, text_hash, _, metadata), embedding in zip(pending, embeddings):
+            if not embedding:
+                print(f"[WARN] Failed to generate embedding for page {metadata['page_num']} of '{metadata['pdf_name']}'. Skipping.")
+                continue
+            vectors.append({
+                "id": vector_id,
+                "values": embedding,
+                "metadata": metadata
+            })
+            stored.append((key, {"id": vector_id, "hash": text_hash, "page_num": metadata["page_num"]}))
+
+        for start in range(0, len(vectors), upsert_batch_size):
+            index.upsert(vectors[start:start + upsert_batch_size])
+
+        # Drop the previous vectors of changed chunks now that their replacements are stored
+        replaced_ids = [manifest[key]["id"] for key, entry in stored
+                        if key in manifest and manifest[key]["id"] != entry["id"]]
+        if replaced_ids:
+            index.delete(ids=replaced_ids)
+        manifest.update(stored)
+
+        # Keep the BM25 keyword index in step with the vector index
+        keyword_index.add_chunks(index_name, document_id, [
+            (vector["id"], vector["metadata"]["page_num"], vector["metadata"]["text"]) for vector in vectors
+        ])
+        keyword_index.delete_chunks(index_name, replaced_ids)
+
+        # Persist the manifest once for the whole batch
+        manifest_store.upsert_chunks(document_id, index_name, stored)
+        print(f"[INFO] Stored {len(vectors)} chunks in Pinecone.")
+        pending.clear()
+
     try:
         for page_data in parsed_data:
             pdf_name = page_data.get("pdf_name", "Unknown PDF")
@@ -72,86 +144,54 @@ def store_in_pinecone(index: pinecone.Index, parsed_data: List[Dict], stored_pag
             for page in page_data.get("pages", []):
                 page_num = page.get("page_num")
                 page_text = page.get("text", "")
+                key = chunk_key(pdf_name, page_num)
+                if key in seen_keys:
+                    continue
+                seen_keys.add(key)
+
+                # Skip chunks whose content has not changed since the last ingestion
+                text_hash = content_hash(page_text)
+                if manifest.get(key, {}).get("hash") == text_hash:
+                    if manifest[key]["id"] not in keyword_ids:
+                        keyword_backfill.append((manifest[key]["id"], page_num, page_text))
+                    continue
+
                 metadata = {
                     "page_num": page_num,
                     "pdf_name": pdf_name,
                     "text": page_text,
                     "document_id": document_id
                 }
-
-                # Check if this page is already tracked locally
-                if (pdf_name, page_num) in stored_pages:
-                    print(f"[INFO] Page {page_num} of '{pdf_name}' already exists in Pinecone. Skipping storage.")
-                    continue
-
-                # Embed and store the new page if not found in local cache
-                embedding = embed_model.get_text_embedding(page_text)  # Replace with actual embedding method
-                if not embedding:
-                    print(f"[WARN] Failed to generate embedding for page {page_num} of '{pdf_name}'. Skipping.")
-                    continue
-
-                print(f"[INFO] Storing page {page_num} of '{pdf_name}' in Pinecone.")
-
-                index.upsert([
-                    {
-                        "id": f"{pdf_name}_page_{page_num}_{uuid.uuid4()}",
-                        "values": embedding,
-                        "metadata": metadata
-                    }
-                ])
-
-                # Add the page to the local cache and save to file
-                stored_pages.add((pdf_name, page_num))
-                save_stored_pages(document_id, stored_pages)
-                print(f"[INFO] Successfully stored page {page_num} of '{pdf_name}' in Pinecone.")
+                pending.append((key, make_vector_id(document_id, key, text_hash), text_hash, page_text, metadata))
+                if len(pending) >= embed_batch_size:
+                    flush()
+
+        if pending:
+            flush()
+        keyword_index.add_chunks(index_name, document_id, keyword_backfill)
+
+        if failures or not seen_keys:
+            print(f"[WARN] Incomplete parse of '{document_id}' ({len(failures or [])} failures, "
+                  f"{len(seen_keys)} chunks). Keeping previously stored chunks.")
+            return len(seen_keys)
+
+        # Chunks that no longer exist in the document
+        stale_keys = [key for key in manifest if key not in seen_keys]
+        stale_ids = [manifest.pop(key)["id"] for key in stale_keys]
+        if stale_ids:
+            for start in range(0, len(stale_ids), upsert_batch_size):
+                index.delete(ids=stale_ids[start:start + upsert_batch_size])
+            manifest_store.delete_chunks(document_id, index_name, stale_keys)
+            keyword_index.delete_chunks(index_name, stale_ids)
+            print(f"[INFO] Deleted {len(stale_ids)} stale chunks from Pinecone.")
+        return len(seen_keys)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error storing data in Pinecone: {str(e)}")
 
 
-def load_stored_pages(document_id: str) -> set:
-    """
-    Loads the set of stored pages from a JSON file.
-    """
-    cwd = os.getcwd()
-    directory = cwd + "/index_histories/"
-
-    history_path = os.path.join(directory, f"{document_id}_stored_pages.json")
-    #    if nested directory is not present, create it
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-    # if json file does not exist, create it
-    if not os.path.exists(history_path):
-        with open(history_path, "w") as f:
-            json.dump([], f)
-
-    logging.info(f"[INFO] Loading stored pages from {history_path}.")
-    if not os.path.exists(history_path):
-        return set()
-    with open(history_path, "r") as f:
-        try:
-            stored_pages = set(tuple(page) for page in json.load(f))
-            return stored_pages
-        except json.JSONDecodeError:
-            print(f"[WARN] Invalid JSON format in {history_path}. Returning empty set.")
-            return set()
-
-
-def save_stored_pages(document_id: str, stored_pages: set):
+def load_manifest(document_id: str, index_name: str) -> Dict[str, Dict]:
     """
-    Saves the set of stored pages to a JSON file for persistence.
+    Loads the chunk manifest ({chunk key: {"id", "hash", "page_num"}}) of a document from the manifest database.
     """
-    cwd = os.getcwd()
-    directory = cwd + "/index_histories/"
-    history_path = os.path.join(directory, f"{document_id}_stored_pages.json")
-    #    if nested directory is not present, create it
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-    # if json file does not exist, create it
-    if not os.path.exists(history_path):
-        with open(history_path, "w") as f:
-            json.dump([], f)
-
-
-    with open(history_path, "w") as f:
-            json.dump(list(stored_pages), f, indent=4)
\ No newline at end of file
+    return manifest_store.load_chunks(document_id, index_name)
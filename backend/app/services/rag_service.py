@@ -1,15 +1,20 @@
 # app/services/rag_service.py
 import logging
+from typing import Iterator, List, Tuple, Union
 
 from llama_index.core.base.llms.types import CompletionResponse
 from llama_index.llms.nvidia import NVIDIA
-from llama_index.llms.openai import OpenAI
 
-from app.document_processors import get_pdf_documents
-from app.services.pinecone_service import initialize_pinecone, setup_pinecone_index, store_in_pinecone, \
-    load_stored_pages
+from app.clients import get_llm
+from app.cache import DiskLRUCache, LRUCache, content_hash, normalize_text
+from app.document_processors import iter_pdf_documents, prefetch
+from app.services import document_registry, keyword_index
+from app.services.answer_cache import answer_cache
+from app.services.context_builder import build_context
+from app.services.pinecone_service import store_in_pinecone, load_manifest
+from app.services.vector_store import VectorMatch, VectorStore, open_vector_store
 
-from app.utils import download_pdf_from_s3, embed_model
+from app.utils import download_pdf_from_s3, get_s3_etag, embed_model
 from fastapi import HTTPException
 import os
 
@@ -18,96 +23,275 @@ PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "rag-index")
 VECTOR_DIMENSION = int(os.getenv("VECTOR_DIMENSION", "1024"))  # Ensure consistency
 SIMILARITY_TOP_K = int(os.getenv("SIMILARITY_TOP_K", "5"))
 
+# Hybrid retrieval: BM25 keyword matches are fused with vector matches by reciprocal rank fusion
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() == "true"
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", str(SIMILARITY_TOP_K * 4)))
+RRF_K = int(os.getenv("RRF_K", "60"))
 
-def initialize_rag(document_id: str):
+SUMMARY_PROMPT = "summarize the document in less than 500 words"
+
+# Query embeddings are cached in memory and, if QUERY_EMBEDDING_CACHE_DIR is set, on disk
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "2048"))
+QUERY_EMBEDDING_CACHE_DIR = os.getenv("QUERY_EMBEDDING_CACHE_DIR")
+QUERY_EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("QUERY_EMBEDDING_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+query_embedding_cache = LRUCache(QUERY_EMBEDDING_CACHE_SIZE)
+query_embedding_disk_cache = DiskLRUCache(QUERY_EMBEDDING_CACHE_DIR, QUERY_EMBEDDING_CACHE_MAX_BYTES) \
+    if QUERY_EMBEDDING_CACHE_DIR else None
+
+
+def get_vector_store() -> VectorStore:
+    """
+    Returns the shared vector store of the RAG index (Pinecone or local, see VECTOR_STORE_BACKEND).
+    """
+    return open_vector_store(PINECONE_INDEX_NAME, VECTOR_DIMENSION)
+
+
+def ingest_document(document_id: str, etag: str = None) -> str:
     """
-    Initializes the RAG setup by downloading the document, processing it, and storing embeddings in Pinecone.
+    Ingestion stage: downloads the document, processes it, and stores its embeddings in Pinecone.
+    Records the ingested S3 ETag in the document registry and returns it.
     """
-    # Initialize Pinecone
-    pinecone = initialize_pinecone()
+    if etag is None:
+        etag = get_s3_etag(document_id)
 
+    with document_registry.ingest_lock(document_id, etag):
+        return _ingest_document_locked(document_id, etag)
+
+
+def _ingest_document_locked(document_id: str, etag: str) -> str:
+    """
+    Body of ingest_document; the caller holds the document's ingest lock.
+    """
     # Download PDF from S3
     pdf_path = download_pdf_from_s3(document_id)
     if not pdf_path:
         raise HTTPException(status_code=404, detail=f"Document {document_id} not found in S3.")
 
-    # Process PDF to extract documents
+    # Load the chunk manifest so only new or changed chunks are embedded
+    manifest = load_manifest(document_id, PINECONE_INDEX_NAME)
+
+    # Parse the PDF page by page in the background and embed/upsert chunks as they arrive
+    failures = []
     with open(pdf_path, "rb") as pdf_file:
-        documents = get_pdf_documents(pdf_file)
+        parsed_data = (
+            {
+                "pdf_name": doc.metadata.get("source", "Unknown PDF"),
+                "pages": [
+                    {
+                        "page_num": doc.metadata.get("page_num", 0),
+                        "text": doc.text
+                    }
+                ]
+            }
+            for doc in prefetch(iter_pdf_documents(pdf_file, failures=failures))
+        )
 
-    # Setup Pinecone index
-    pinecone_index = setup_pinecone_index(PINECONE_INDEX_NAME, VECTOR_DIMENSION, pinecone)
+        # Store data in Pinecone
+        chunks = store_in_pinecone(get_vector_store(), parsed_data, manifest, document_id, PINECONE_INDEX_NAME,
+                                   failures=failures)
+    if not chunks:
+        raise HTTPException(status_code=422, detail=f"No content could be extracted from {document_id}.")
+    if failures:
+        # Serve what was stored, but don't record this version as ingested so it is retried
+        # once the ready flag expires
+        logging.warning(f"[WARN] Ingested {document_id} with {len(failures)} failures: {failures[:5]}")
+        document_registry.mark_ready(document_id, etag)
+    else:
+        document_registry.mark_ready(document_id, etag, persist=True)
+    answer_cache.invalidate(document_id)
+    logging.info(f"Ingested document {document_id} (etag {etag})")
+    return etag
 
-    # Load stored pages to avoid duplication
-    stored_pages = load_stored_pages(document_id)
 
-    # Prepare parsed_data in the required format
-    parsed_data = []
-    for doc in documents:
-        parsed_data.append({
-            "pdf_name": doc.metadata.get("source", "Unknown PDF"),
-            "pages": [
-                {
-                    "page_num": doc.metadata.get("page_num", 0),
-                    "text": doc.text
-                }
-            ]
-        })
+def ensure_document_ready(document_id: str):
+    """
+    Makes sure the current S3 version of the document is ingested, running ingestion at most once
+    per (S3 key, ETag). Returns immediately when the document is already flagged as ready, and
+    raises a 503 if another request is still ingesting it after INGEST_WAIT_SECONDS.
+    """
+    if document_registry.is_ready(document_id):
+        return
 
-    # Store data in Pinecone
-    store_in_pinecone(pinecone_index, parsed_data, stored_pages, document_id)
-    return pinecone
+    etag = get_s3_etag(document_id)
+    if document_registry.is_ingested(document_id, etag):
+        document_registry.mark_ready(document_id, etag)
+        return
 
+    with document_registry.ingest_lock(document_id, etag):
+        # Another request may have finished ingesting while we waited for the lock
+        if document_registry.is_ready(document_id):
+            return
+        if document_registry.is_ingested(document_id, etag):
+            document_registry.mark_ready(document_id, etag)
+            return
+        _ingest_document_locked(document_id, etag)
 
-def query_chat(document_id: str, message: str) -> str:
+
+def embed_query(message: str) -> list:
     """
-    Handle a chat query by retrieving relevant documents from Pinecone and generating a response.
+    Returns the embedding of a query, served from the query-embedding cache when possible.
+    """
+    cache_key = content_hash(embed_model.model, normalize_text(message))
+    embedding = query_embedding_cache.get(cache_key)
+    if embedding is not None:
+        return embedding
+
+    if query_embedding_disk_cache is not None:
+        embedding = query_embedding_disk_cache.get(cache_key)
+    if embedding is None:
+        embedding = embed_model.get_text_embedding(message)
+        if not embedding:
+            return embedding
+        if query_embedding_disk_cache is not None:
+            query_embedding_disk_cache.set(cache_key, embedding)
+    query_embedding_cache.set(cache_key, embedding)
+    return embedding
+
+
+def document_filter(document_ids: List[str]) -> dict:
+    """
+    Builds the Pinecone metadata filter restricting retrieval to the given documents.
+    """
+    if len(document_ids) == 1:
+        return {"document_id": {"$eq": document_ids[0]}}
+    return {"document_id": {"$in": document_ids}}
+
+
+def reciprocal_rank_fusion(rankings: List[List[VectorMatch]], top_k: int, k: int = RRF_K) -> List[VectorMatch]:
+    """
+    Merges ranked match lists: each match scores sum(1 / (k + rank)) over the lists it appears in.
+    """
+    scores = {}
+    matches = {}
+    for ranking in rankings:
+        for rank, match in enumerate(ranking, start=1):
+            scores[match.id] = scores.get(match.id, 0.0) + 1.0 / (k + rank)
+            matches.setdefault(match.id, match)
+    fused = sorted(scores, key=scores.get, reverse=True)[:top_k]
+    return [VectorMatch(match_id, scores[match_id], matches[match_id].metadata) for match_id in fused]
+
+
+def retrieve(document_id: Union[str, List[str]], message: str) -> Tuple[str, List[str], list, List[VectorMatch]]:
+    """
+    Retrieval stage of a chat query: makes sure the documents are ingested, then returns the answer
+    cache key of the document set, the retrieved chunk IDs, the query embedding and the matches.
     """
-    # Initialize RAG (ensure embeddings are stored)
-    pinecone = initialize_rag(document_id)
+    document_ids = [document_id] if isinstance(document_id, str) else list(document_id)
+    if not document_ids:
+        raise HTTPException(status_code=400, detail="At least one document ID is required.")
 
-    # Setup Pinecone index
-    pinecone_index = pinecone.Index(PINECONE_INDEX_NAME)
+    # Ingest the documents on first use; afterwards this is a cached flag lookup
+    for doc_id in document_ids:
+        ensure_document_ready(doc_id)
+
+    vector_store = get_vector_store()
 
     # Generate embedding for the query
-    query_embedding = embed_model.get_text_embedding(message)
+    query_embedding = embed_query(message)
     if not query_embedding:
         raise HTTPException(status_code=500, detail="Failed to generate embedding for the query.")
 
-    # Query Pinecone for similar vectors
+    # Query the vector store for similar vectors
+    candidates = RETRIEVAL_CANDIDATES if HYBRID_SEARCH else SIMILARITY_TOP_K
     try:
-        results = pinecone_index.query(
-            vector=query_embedding,
-            top_k=SIMILARITY_TOP_K,
-            include_metadata=True
-        )
+        matches = vector_store.query(query_embedding, candidates, filter=document_filter(document_ids))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error querying Pinecone: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error querying the vector store: {str(e)}")
+
+    # Fuse with BM25 keyword matches so exact tickers, figures and terms are not missed
+    if HYBRID_SEARCH:
+        try:
+            keyword_matches = keyword_index.search(PINECONE_INDEX_NAME, message, document_ids, candidates)
+        except Exception as e:
+            logging.warning(f"[WARN] Keyword search failed, using vector matches only: {e}")
+            keyword_matches = []
+        matches = reciprocal_rank_fusion([matches, keyword_matches], SIMILARITY_TOP_K)
+
+    chunk_ids = [match.id for match in matches]
+    cache_document_id = ",".join(sorted(document_ids))
+    return cache_document_id, chunk_ids, query_embedding, matches
+
+
+def prepare_context(matches: List[VectorMatch]) -> str:
+    """
+    Deduplicates, orders and trims the retrieved text to the context token budget.
+    """
+    context = build_context(matches)
+    logging.info(f"Context: {context.tokens} tokens from {context.chunks} chunks "
+                 f"({context.duplicates} duplicates dropped, {context.truncated} truncated)")
+    return context.text
 
-    # Aggregate relevant text from the results
-    relevant_text = ""
-    for match in results.matches:
-        relevant_text += match.metadata.get("text", "") + "\n"
+
+def query_chat(document_id: Union[str, List[str]], message: str) -> str:
+    """
+    Handle a chat query by retrieving relevant documents from Pinecone and generating a response.
+    Retrieval is restricted to the given document, or to each document of a list of IDs.
+    """
+    cache_document_id, chunk_ids, query_embedding, matches = retrieve(document_id, message)
+
+    # Serve repeated questions over the same retrieved chunks from the answer cache
+    cached_answer = answer_cache.get(cache_document_id, chunk_ids, message, query_embedding)
+    if cached_answer is not None:
+        return cached_answer
 
     # Generate response using the LLM
     try:
-        response = generate_response(relevant_text, message)
+        response = generate_response(prepare_context(matches), message)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating response: {str(e)}")
 
+    answer_cache.set(cache_document_id, chunk_ids, message, response.text, query_embedding)
     return response.text
 
 
+def stream_chat(document_id: Union[str, List[str]], message: str) -> Iterator[str]:
+    """
+    Streaming variant of query_chat. Retrieval runs before this returns, so its errors are raised
+    as usual; the returned iterator then yields the answer in pieces as the LLM produces them.
+    The complete answer is added to the answer cache once the stream ends.
+    """
+    cache_document_id, chunk_ids, query_embedding, matches = retrieve(document_id, message)
+
+    cached_answer = answer_cache.get(cache_document_id, chunk_ids, message, query_embedding)
+    if cached_answer is not None:
+        return iter([cached_answer])
+
+    relevant_text = prepare_context(matches)
+
+    def deltas():
+        parts = []
+        for response in stream_response(relevant_text, message):
+            if response.delta:
+                parts.append(response.delta)
+                yield response.delta
+        answer_cache.set(cache_document_id, chunk_ids, message, "".join(parts), query_embedding)
+
+    return deltas()
+
+
 def summarize_document(document_id: str, message: str = None) -> str:
     """
     Summarizes the document based on the user's message.
     """
     logging.info(f"Summarizing document {document_id}")
-    message ="summarize the document in less than 500 words"
+    message = SUMMARY_PROMPT
     # The summarization logic can be similar to chat
     return query_chat(document_id, message)
 
 
+def stream_summary(document_id: str) -> Iterator[str]:
+    """
+    Streaming variant of summarize_document.
+    """
+    logging.info(f"Streaming summary of document {document_id}")
+    return stream_chat(document_id, SUMMARY_PROMPT)
+
+
+def build_prompt(relevant_text: str, user_message: str) -> str:
+    return f"Based on the following information:\n{relevant_text}\n\nUser Question: {user_message}\n\nProvide a detailed Markdown-formatted answer."
+
+
 def generate_response(relevant_text: str, user_message: str):
     """
     Generates a Markdown-formatted response using the LLM based on relevant text and user message.
@@ -115,8 +299,16 @@ def generate_response(relevant_text: str, user_message: str):
     # Implement the logic to interact with the LLM
     # Example using the NVIDIA LLM
     # llm_model_name = os.getenv("LLM_MODEL_NAME", "meta/llama-3.1-70b-instruct")
-    llm = OpenAI()
-    prompt = f"Based on the following information:\n{relevant_text}\n\nUser Question: {user_message}\n\nProvide a detailed Markdown-formatted answer."
+    llm = get_llm()
+    prompt = build_prompt(relevant_text, user_message)
     # print(prompt)
     response = llm.complete(prompt)
-    return response
\ No newline at end of file
+    return response
+
+
+def stream_response(relevant_text: str, user_message: str):
+    """
+    Streams the response of generate_response; each CompletionResponse carries the new text in delta.
+    """
+    llm = get_llm()
+    return llm.stream_complete(build_prompt(relevant_text, user_message))
@@ -1,61 +1,103 @@
-
-import os
-import uuid
-import pickle
+import gzip
 import json
-import boto3
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict
+from typing import Callable, List, Dict
 from pydantic import BaseModel
 from fastapi import HTTPException
-from llama_index.core import SummaryIndex, StorageContext, load_index_from_storage
-from llama_index.core.schema import TextNode
 from llama_index.llms.openai import OpenAI
 from llama_index.embeddings.openai import OpenAIEmbedding
-from pinecone import Pinecone, ServerlessSpec
-from pinecone import Index
 from llama_parse import LlamaParse
 
-from app.models.report_models import ReportOutput
+from app.cache import DiskLRUCache, content_hash, file_hash
+from app.clients import get_s3_client
+from app.services import manifest_store
+from app.services.pinecone_service import chunk_key, make_vector_id, UPSERT_BATCH_SIZE
+from app.services.vector_store import open_vector_store
+from app.utils import get_s3_etag
+
+# Bump when the report prompts or layout change so cached reports are regenerated
+REPORT_PROMPT_VERSION = "2"
+
+# Reports are summarized map-reduce style: every page is summarized on its own (at most
+# REPORT_SUMMARY_WORKERS at a time), and the page summaries are combined REPORT_REDUCE_FANIN at a
+# time until one summary is left. Each summary is cached by its input, so unchanged pages are
+# not summarized again.
+REPORT_SUMMARY_WORKERS = int(os.getenv("REPORT_SUMMARY_WORKERS", "8"))
+REPORT_REDUCE_FANIN = int(os.getenv("REPORT_REDUCE_FANIN", "20"))
+REPORT_MIN_PAGE_CHARS = int(os.getenv("REPORT_MIN_PAGE_CHARS", "200"))
+# Kept apart from PARSE_CACHE_DIR, whose eviction would otherwise count and drop the summaries
+SUMMARY_CACHE_DIR = os.getenv("SUMMARY_CACHE_DIR", os.path.join(os.getcwd(), "summary_cache"))
+SUMMARY_CACHE_MAX_BYTES = int(os.getenv("SUMMARY_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+REPORT_MODEL = "gpt-4o"
+PAGE_SUMMARY_PROMPT = (
+    "Summarize the key financial insights, figures and any described charts or tables on page {page_num} "
+    "of a research publication in at most 80 words.\n\n{text}"
+)
+COMBINE_SUMMARIES_PROMPT = (
+    "Combine the following page summaries of a research publication into a single summary of at most "
+    "150 words that keeps the most important financial insights and figures.\n\n{summaries}"
+)
+FINAL_SUMMARY_PROMPT = "Generate a concise financial summary of the document from these page summaries.\n\n{summaries}"
 
-# create stored_pages.json file
+# LlamaParse results are cached by PDF content hash and parser settings as gzipped JSON.
+# PARSE_CACHE_DIR may be a volume shared by several workers; PARSE_CACHE_S3_BUCKET adds a
+# shared S3 tier that is checked on a local miss.
+PARSE_CACHE_VERSION = "1"
+PARSE_CACHE_DIR = os.getenv("PARSE_CACHE_DIR", os.path.join(os.getcwd(), "parse_cache"))
+PARSE_CACHE_MAX_BYTES = int(os.getenv("PARSE_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+PARSE_CACHE_S3_BUCKET = os.getenv("PARSE_CACHE_S3_BUCKET")
+PARSE_CACHE_S3_PREFIX = os.getenv("PARSE_CACHE_S3_PREFIX", "parse-cache/")
+LLAMA_PARSE_SETTINGS = {
+    "result_type": "markdown",
+    "use_vendor_multimodal_model": True,
+    "vendor_multimodal_model_name": "openai-gpt-4o-mini",
+}
 
 
 class ReportService:
     def __init__(self):
-        self.s3_client = boto3.client('s3')
-        self.LLAMA_PARSED_DIR = "./llama_parsed"
-        os.makedirs(self.LLAMA_PARSED_DIR, exist_ok=True)
+        self.s3_client = get_s3_client()
+        self.parse_cache = DiskLRUCache(PARSE_CACHE_DIR, PARSE_CACHE_MAX_BYTES, compress=True)
         self.embedding_dimension = 3072
         self.index_name = "multimodalindex"
-        self.pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
         self.embed_model = OpenAIEmbedding(model="text-embedding-3-large", api_key=os.getenv("OPENAI_API_KEY"))
-        self.llm = OpenAI(model="gpt-4o", system_prompt="You are a report generation assistant...")
-        self.pinecone_index = self.setup_pinecone_index()
-        self.stored_pages = self.load_stored_pages()
+        self.llm = OpenAI(model=REPORT_MODEL, system_prompt="You are a report generation assistant...")
+        self.summary_llm = OpenAI(model=REPORT_MODEL, system_prompt=(
+            "You are a report generation assistant. Generate a brief, single-paragraph summary "
+            "that highlights key financial insights and any relevant visuals, keeping it under 100 words."
+        ))
+        self.pinecone_index = open_vector_store(self.index_name, self.embedding_dimension)
         self.output_dir = Path("output_reports")
         self.output_dir.mkdir(exist_ok=True)
-        self.STORED_PAGES_FILE = "stored_pages.json"
-
-    def setup_pinecone_index(self) -> Index:
-        indexes = self.pc.list_indexes()
-        if any(index['name'] == self.index_name for index in indexes.get('indexes', [])):
-            pinecone_index = self.pc.Index(self.index_name)
-        else:
-            self.pc.create_index(
-                name=self.index_name,
-                dimension=self.embedding_dimension,
-                metric="cosine",
-                spec=ServerlessSpec(
-                    cloud="aws",
-                    region="us-east-1"
-                )
-            )
-            pinecone_index = self.pc.Index(self.index_name)
-        return pinecone_index
+        self.images_dir = Path("data_images")
+        self.summary_cache = DiskLRUCache(SUMMARY_CACHE_DIR, SUMMARY_CACHE_MAX_BYTES)
+
+    def report_path(self, pdf_name: str, etag: str) -> Path:
+        """
+        Returns the report PDF path of one version of a document, keyed by the S3 ETag and
+        REPORT_PROMPT_VERSION.
+        """
+        document_key = content_hash(pdf_name)[:16]
+        version_key = content_hash(etag, REPORT_PROMPT_VERSION)[:16]
+        return self.output_dir / document_key / f"{version_key}.pdf"
+
+    def remove_stale_reports(self, report_pdf_path: Path):
+        """
+        Deletes reports of older versions of a document.
+        """
+        for path in report_pdf_path.parent.glob("*.pdf"):
+            if path != report_pdf_path:
+                path.unlink(missing_ok=True)
 
     def download_pdf_from_s3(self, pdf_name: str) -> str:
-        temp_dir = "/tmp/"
+        # A private directory per download, so concurrent reports never share a file
+        temp_dir = tempfile.mkdtemp(prefix="report-")
         pdf_path = os.path.join(temp_dir, f"{os.path.basename(pdf_name)}")
         try:
             self.s3_client.download_file("cfapublications", pdf_name, pdf_path)
@@ -63,98 +105,180 @@ class ReportService:
             raise HTTPException(status_code=500, detail=f"Error downloading PDF from S3: {str(e)}")
         return pdf_path
 
-    def parse_document(self, pdf_path: str) -> List[dict]:
-        parsed_file = os.path.join(self.LLAMA_PARSED_DIR, os.path.basename(pdf_path) + ".json")
-        if os.path.exists(parsed_file):
-            with open(parsed_file, "rb") as f:
-                parsed_data = pickle.load(f)
-        else:
-            parser = LlamaParse(
-                result_type="markdown",
-                use_vendor_multimodal_model=True,
-                vendor_multimodal_model_name="openai-gpt-4o-mini",
-                api_key=os.getenv("LLAMA_PARSE_API_KEY")
-            )
+    def parse_cache_key(self, pdf_path: str) -> str:
+        """
+        Cache key of a PDF's parse: its content hash, the parser settings and PARSE_CACHE_VERSION.
+        """
+        return content_hash(file_hash(pdf_path), json.dumps(LLAMA_PARSE_SETTINGS, sort_keys=True),
+                            PARSE_CACHE_VERSION)
+
+    def _get_shared_parse(self, cache_key: str):
+        if not PARSE_CACHE_S3_BUCKET:
+            return None
+        try:
+            response = self.s3_client.get_object(Bucket=PARSE_CACHE_S3_BUCKET,
+                                                 Key=f"{PARSE_CACHE_S3_PREFIX}{cache_key}.json.gz")
+        except self.s3_client.exceptions.NoSuchKey:
+            return None
+        except Exception as e:
+            logging.warning(f"[WARN] Could not read shared parse cache: {e}")
+            return None
+        return json.loads(gzip.decompress(response["Body"].read()))
+
+    def _put_shared_parse(self, cache_key: str, parsed_data: List[dict]):
+        if not PARSE_CACHE_S3_BUCKET:
+            return
+        try:
+            self.s3_client.put_object(Bucket=PARSE_CACHE_S3_BUCKET, Key=f"{PARSE_CACHE_S3_PREFIX}{cache_key}.json.gz",
+                                      Body=gzip.compress(json.dumps(parsed_data).encode("utf-8")),
+                                      ContentType="application/json", ContentEncoding="gzip")
+        except Exception as e:
+            logging.warning(f"[WARN] Could not write shared parse cache: {e}")
+
+    def parse_document(self, pdf_path: str, cache_key: str = None) -> List[dict]:
+        """
+        Parses a PDF with LlamaParse unless an identical PDF was parsed before with the same
+        settings, in which case the cached result is returned.
+        """
+        cache_key = cache_key or self.parse_cache_key(pdf_path)
+        parsed_data = self.parse_cache.get(cache_key)
+        if parsed_data is None:
+            parsed_data = self._get_shared_parse(cache_key)
+            if parsed_data is not None:
+                self.parse_cache.set(cache_key, parsed_data)
+        parser = LlamaParse(**LLAMA_PARSE_SETTINGS, api_key=os.getenv("LLAMA_PARSE_API_KEY"))
+        if parsed_data is None:
             parsed_data = parser.get_json_result(pdf_path)
-            os.makedirs("data_images", exist_ok=True)
-            os.makedirs(self.LLAMA_PARSED_DIR, exist_ok=True)
-            parser.get_images(parsed_data, download_path="data_images")
-            with open(parsed_file, "wb") as f:
-                pickle.dump(parsed_data, f)
+            # Cache the paid parse before anything else can fail
+            self.parse_cache.set(cache_key, parsed_data)
+            self._put_shared_parse(cache_key, parsed_data)
+        # Fetches the page images of the parse job (no new parse) unless they are already here
+        self.fetch_images(parser, parsed_data, cache_key)
         return parsed_data
 
-    def store_in_pinecone(self, parsed_data: List[dict]):
+    def fetch_images(self, parser: LlamaParse, parsed_data: List[dict], cache_key: str):
+        """
+        Downloads the page images of a parse into its image directory. They are fetched into a
+        temporary directory that is renamed once complete, so a failed download is retried later.
+        """
+        image_dir = self.image_dir(cache_key)
+        if os.path.isdir(image_dir):
+            return
+        self.images_dir.mkdir(exist_ok=True)
+        temp_dir = tempfile.mkdtemp(prefix=".images-", dir=self.images_dir)
         try:
+            parser.get_images(parsed_data, download_path=temp_dir)
+            os.rename(temp_dir, image_dir)
+        except Exception as e:
+            # Includes another worker having renamed its copy into place first
+            if not os.path.isdir(image_dir):
+                logging.warning(f"[WARN] Could not fetch page images: {e}")
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def image_dir(self, cache_key: str) -> str:
+        # Page images of a parsed document, keyed like its parse cache entry
+        return str(self.images_dir / cache_key[:16])
+
+    def store_in_pinecone(self, parsed_data: List[dict], document_id: str):
+        try:
+            manifest = manifest_store.load_chunks(document_id, self.index_name)
+            vectors = []
+            stored = []
             for page_data in parsed_data:
-                pdf_name = "Test PDF"
                 for page in page_data.get("pages", []):
                     page_num = page.get("page")
                     page_text = page.get("md", "")
+                    key = chunk_key(document_id, page_num)
+                    text_hash = content_hash(page_text)
+                    if manifest.get(key, {}).get("hash") == text_hash:
+                        continue
                     metadata = {
                         "page_num": page_num,
-                        "pdf_name": pdf_name,
+                        "pdf_name": document_id,
                         "text": page_text
                     }
-                    if (pdf_name, page_num) in self.stored_pages:
-                        continue
+                    vector_id = make_vector_id(document_id, key, text_hash)
                     embedding = self.embed_model._get_text_embedding(page_text)
-                    self.pinecone_index.upsert([{
-                        "id": str(uuid.uuid4()),
+                    vectors.append({
+                        "id": vector_id,
                         "values": embedding,
                         "metadata": metadata
-                    }])
-                    self.stored_pages.add((pdf_name, page_num))
-                    self.save_stored_pages()
+                    })
+                    stored.append((key, {"id": vector_id, "hash": text_hash, "page_num": page_num}))
+            for start in range(0, len(vectors), UPSERT_BATCH_SIZE):
+                self.pinecone_index.upsert(vectors[start:start + UPSERT_BATCH_SIZE])
+            replaced_ids = [manifest[key]["id"] for key, entry in stored
+                            if key in manifest and manifest[key]["id"] != entry["id"]]
+            if replaced_ids:
+                self.pinecone_index.delete(ids=replaced_ids)
+            manifest_store.upsert_chunks(document_id, self.index_name, stored)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error storing data in Pinecone: {str(e)}")
 
-    def load_stored_pages(self) -> set:
-        if os.path.exists(self.STORED_PAGES_FILE):
-            with open(self.STORED_PAGES_FILE, "r") as f:
-                return set(tuple(page) for page in json.load(f))
-        return set()
-
-    def save_stored_pages(self):
-        with open(self.STORED_PAGES_FILE, "w") as f:
-            json.dump([list(page) for page in self.stored_pages], f)
-
-    def generate_structured_report(self, parsed_data: List[dict]) -> str:
-        storage_dir = "storage_nodes_summary"
-        text_nodes = self.get_text_nodes(parsed_data[0]["pages"], image_dir="data_images")
-        if not os.path.exists(storage_dir):
-            index = SummaryIndex(text_nodes)
-            index.set_index_id("summary_index")
-            index.storage_context.persist(storage_dir)
-        else:
-            storage_context = StorageContext.from_defaults(persist_dir=storage_dir)
-            index = load_index_from_storage(storage_context, index_id="summary_index")
-        system_prompt = (
-            "You are a report generation assistant. Generate a brief, single-paragraph summary "
-            "that highlights key financial insights and any relevant visuals, keeping it under 100 words."
-        )
-        llm = OpenAI(model="gpt-4o", system_prompt=system_prompt)
-        sllm = llm.as_structured_llm(output_cls=ReportOutput)
-        query_engine = index.as_query_engine(
-            similarity_top_k=5,
-            llm=sllm,
-            response_mode="compact"
+    def complete_cached(self, llm: OpenAI, prompt: str) -> str:
+        """
+        Runs a completion, reusing the cached answer for an identical model, system prompt and prompt.
+        """
+        cache_key = content_hash(llm.model, llm.system_prompt or "", prompt)
+        text = self.summary_cache.get(cache_key)
+        if text is None:
+            text = llm.complete(prompt).text
+            self.summary_cache.set(cache_key, text)
+        return text
+
+    def summarize_pages(self, parsed_pages: List[dict], progress: Callable[[float, str], None] = None) -> List[dict]:
+        """
+        Map step: summarizes every page with enough text concurrently, or every page with any text
+        if none reaches REPORT_MIN_PAGE_CHARS. Returns [{"page_num", "summary"}] in page order.
+        """
+        pages = [(page.get("page"), page.get("md", "").strip()) for page in parsed_pages]
+        pages = [(page_num, text) for page_num, text in pages if text]
+        # Slide decks and scanned or chart-heavy PDFs may have no page that long; summarize them all then
+        pages = [(page_num, text) for page_num, text in pages if len(text) >= REPORT_MIN_PAGE_CHARS] or pages
+        summaries = []
+        with ThreadPoolExecutor(max_workers=REPORT_SUMMARY_WORKERS, thread_name_prefix="page-summary") as executor:
+            futures = [executor.submit(self.complete_cached, self.llm,
+                                       PAGE_SUMMARY_PROMPT.format(page_num=page_num, text=text))
+                       for page_num, text in pages]
+            for (page_num, _), future in zip(pages, futures):
+                summaries.append({"page_num": page_num, "summary": future.result()})
+                if progress:
+                    progress(len(summaries) / len(pages), f"Summarized {len(summaries)}/{len(pages)} pages")
+        return summaries
+
+    def reduce_summaries(self, summaries: List[str]) -> str:
+        """
+        Reduce step: combines page summaries REPORT_REDUCE_FANIN at a time until they fit into
+        the final summary prompt.
+        """
+        while len(summaries) > REPORT_REDUCE_FANIN:
+            groups = [summaries[i:i + REPORT_REDUCE_FANIN] for i in range(0, len(summaries), REPORT_REDUCE_FANIN)]
+            with ThreadPoolExecutor(max_workers=REPORT_SUMMARY_WORKERS, thread_name_prefix="reduce-summary") as executor:
+                summaries = list(executor.map(
+                    lambda group: self.complete_cached(self.llm, COMBINE_SUMMARIES_PROMPT.format(
+                        summaries="\n\n".join(group))),
+                    groups
+                ))
+        return self.complete_cached(self.summary_llm, FINAL_SUMMARY_PROMPT.format(summaries="\n\n".join(summaries)))
+
+    def generate_structured_report(self, parsed_data: List[dict], image_dir: str = None,
+                                   progress: Callable[[float, str], None] = None) -> str:
+        page_summaries = self.summarize_pages(parsed_data[0]["pages"], progress)
+        if not page_summaries:
+            raise HTTPException(status_code=422, detail="The document has no text to summarize.")
+        summary = self.reduce_summaries(
+            [f"Page {page['page_num']}: {page['summary']}" for page in page_summaries]
         )
-        response = query_engine.query("Generate a concise financial summary.")
-        markdown_output = self.process_response_to_markdown(response)
-        return markdown_output
 
-    def get_text_nodes(self, parsed_pages, image_dir=None):
-        text_nodes = []
-        image_files = self._get_sorted_image_files(image_dir) if image_dir else []
-        combined_text = "\n".join(page.get("md", "") for page in parsed_pages)
-        metadata = {"page_num": 1, "parsed_text_markdown": combined_text}
-        if image_files:
-            metadata["image_path"] = str(image_files[0])
-        node = TextNode(text=combined_text, metadata=metadata)
-        text_nodes.append(node)
-        return text_nodes
+        page_images = {}
+        for image_file in (self._get_sorted_image_files(image_dir) if image_dir else []):
+            page_images.setdefault(self.get_page_number(image_file), image_file)
+        return self.render_markdown(summary, page_summaries, page_images)
 
     def _get_sorted_image_files(self, image_dir):
+        if not Path(image_dir).is_dir():
+            return []
         raw_files = [f for f in list(Path(image_dir).iterdir()) if f.is_file()]
         return sorted(raw_files, key=self.get_page_number)
 
@@ -163,33 +287,64 @@ class ReportService:
         match = re.search(r"-page-(\d+)\.jpg$", str(file_name))
         return int(match.group(1)) if match else 0
 
-    def process_response_to_markdown(self, response_instance) -> str:
-        markdown_output = f"## Report Summary\n\n{response_instance.response.text}\n\n---\n\n"
+    def render_markdown(self, summary: str, page_summaries: List[dict], page_images: Dict[int, Path]) -> str:
+        markdown_output = f"## Report Summary\n\n{summary}\n\n---\n\n"
         markdown_output += "### Source Details\n\n"
-        for idx, node in enumerate(response_instance.source_nodes, start=1):
-            metadata = node.node.metadata
-            markdown_output += f"#### Page {metadata.get('page_num', idx)}\n\n"
-            main_text = metadata.get("parsed_text_markdown", "").strip()
-            if main_text:
-                markdown_output += f"{main_text}\n\n"
-            image_path = metadata.get("image_path")
+        for page in page_summaries:
+            markdown_output += f"#### Page {page['page_num']}\n\n{page['summary'].strip()}\n\n"
+            image_path = page_images.get(page["page_num"])
             if image_path:
-                markdown_output += f"![Image for Page {metadata['page_num']}]({image_path})\n\n"
+                markdown_output += f"![Image for Page {page['page_num']}]({image_path})\n\n"
             markdown_output += "---\n\n"
         return markdown_output
 
-    def convert_markdown_to_pdf(self, markdown_content: str) -> str:
+    def convert_markdown_to_pdf(self, markdown_content: str, output_path: Path) -> str:
         import markdown
         import pdfkit
         html_content = markdown.markdown(markdown_content)
-        output_path = self.output_dir / "report_summary.pdf"
-        pdfkit.from_string(html_content, str(output_path))
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        # Render next to the target and rename, so a half-written report is never served
+        tmp_path = output_path.with_name(f"{output_path.stem}.{os.getpid()}.{threading.get_ident()}.tmp.pdf")
+        pdfkit.from_string(html_content, str(tmp_path))
+        os.replace(tmp_path, output_path)
         return str(output_path)
 
-    def generate_report(self, pdf_name: str) -> str:
+    def generate_report(self, pdf_name: str, progress: Callable[[float, str], None] = None) -> str:
+        """
+        Returns the report PDF of the current S3 version of a document, generating it only if no
+        report exists yet for that version (ETag) and REPORT_PROMPT_VERSION.
+        """
+        progress = progress or (lambda fraction, message: None)
+        etag = get_s3_etag(pdf_name)
+        report_pdf_path = self.report_path(pdf_name, etag)
+        if report_pdf_path.exists():
+            progress(1.0, "Report is up to date")
+            return str(report_pdf_path)
+
+        progress(0.0, "Downloading PDF")
         pdf_path = self.download_pdf_from_s3(pdf_name)
-        parsed_data = self.parse_document(pdf_path)
-        self.store_in_pinecone(parsed_data)
-        markdown_output = self.generate_structured_report(parsed_data)
-        report_pdf_path = self.convert_markdown_to_pdf(markdown_output)
-        return report_pdf_path
+        try:
+            progress(0.1, "Parsing document")
+            parse_key = self.parse_cache_key(pdf_path)
+            parsed_data = self.parse_document(pdf_path, parse_key)
+            progress(0.4, "Storing embeddings")
+            self.store_in_pinecone(parsed_data, pdf_name)
+            markdown_output = self.generate_structured_report(
+                parsed_data, self.image_dir(parse_key),
+                progress=lambda fraction, message: progress(0.5 + 0.4 * fraction, message)
+            )
+            progress(0.9, "Rendering PDF")
+            self.convert_markdown_to_pdf(markdown_output, report_pdf_path)
+        finally:
+            shutil.rmtree(os.path.dirname(pdf_path), ignore_errors=True)
+        self.remove_stale_reports(report_pdf_path)
+        return str(report_pdf_path)
+
+
+def run_report_job(params: Dict, progress: Callable[[float, str], None]) -> Dict:
+    """
+    Job queue handler for "report" jobs.
+    """
+    from app.clients import get_report_service
+    report_pdf_path = get_report_service().generate_report(params["pdf_name"], progress=progress)
+    return {"report_path": report_pdf_path}
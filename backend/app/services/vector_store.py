@@ -0,0 +1,382 @@
+# app/services/vector_store.py
+import fcntl
+import json
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# "pinecone" (default) or "local" for the in-process NumPy store
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "pinecone")
+LOCAL_VECTOR_STORE_DIR = os.getenv("LOCAL_VECTOR_STORE_DIR", os.path.join(os.getcwd(), "vectorstore", "local_index"))
+# Below this many candidate vectors the local store scores them all exactly instead of using the IVF index
+IVF_MIN_VECTORS = int(os.getenv("IVF_MIN_VECTORS", "4096"))
+# Number of IVF lists probed per query
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+# Deleted rows are compacted away once they exceed this fraction of the store
+COMPACT_DELETED_FRACTION = 0.25
+
+
+@dataclass
+class VectorMatch:
+    id: str
+    score: float
+    metadata: Dict = field(default_factory=dict)
+
+
+class VectorStore(ABC):
+    """
+    Minimal vector index interface shared by the Pinecone and local backends. Vectors use the
+    Pinecone upsert format: {"id": str, "values": List[float], "metadata": dict}.
+    """
+
+    @abstractmethod
+    def upsert(self, vectors: List[Dict]):
+        ...
+
+    @abstractmethod
+    def delete(self, ids: List[str]):
+        ...
+
+    @abstractmethod
+    def query(self, vector: List[float], top_k: int, filter: Optional[Dict] = None) -> List[VectorMatch]:
+        ...
+
+
+class PineconeVectorStore(VectorStore):
+    """
+    VectorStore backed by a Pinecone index.
+    """
+
+    def __init__(self, index):
+        self.index = index
+
+    def upsert(self, vectors: List[Dict]):
+        self.index.upsert(vectors)
+
+    def delete(self, ids: List[str]):
+        self.index.delete(ids=ids)
+
+    def query(self, vector: List[float], top_k: int, filter: Optional[Dict] = None) -> List[VectorMatch]:
+        results = self.index.query(vector=vector, top_k=top_k, include_metadata=True, filter=filter)
+        return [VectorMatch(id=match.id, score=match.score, metadata=match.metadata or {})
+                for match in results.matches]
+
+
+class LocalVectorStore(VectorStore):
+    """
+    In-process VectorStore for small tenants, tests and benchmarks.
+
+    Vectors are L2-normalized float32 rows appended to a memory-mapped file, with ids and metadata
+    in an append-only JSON-lines log. Queries score candidates by cosine similarity, exactly when
+    there are few of them and through an IVF (k-means inverted file) index otherwise. Metadata
+    filters support Pinecone's $eq, $ne, $in, $nin, $and and $or operators.
+    """
+
+    def __init__(self, directory: str, dimension: int):
+        self.directory = directory
+        self.dimension = dimension
+        self._vectors_path = os.path.join(directory, "vectors.f32")
+        self._records_path = os.path.join(directory, "records.jsonl")
+        self._centroids_path = os.path.join(directory, "centroids.npy")
+        self._lock_path = os.path.join(directory, ".lock")
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    # Persistence
+
+    def _load(self):
+        self._ids = []
+        self._metadata = []
+        self._rows = {}
+        self._deleted = set()
+        self._record_stat = self._stat()
+        if os.path.exists(self._records_path):
+            with open(self._records_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A line still being appended by another process; it is picked up on the next reload
+                        break
+                    if record["op"] == "upsert":
+                        row = record["row"]
+                        if row == len(self._ids):
+                            self._ids.append(record["id"])
+                            self._metadata.append(record["metadata"])
+                        else:
+                            self._deleted.discard(row)
+                            self._metadata[row] = record["metadata"]
+                        self._rows[record["id"]] = row
+                    else:
+                        row = self._rows.pop(record["id"], None)
+                        if row is not None:
+                            self._deleted.add(row)
+        self._open_vectors()
+        self._field_indexes = {}
+        self._centroids = np.load(self._centroids_path) if os.path.exists(self._centroids_path) else None
+        self._assign_lists()
+
+    def _open_vectors(self):
+        rows = len(self._ids)
+        if rows == 0:
+            self._vectors = np.zeros((0, self.dimension), dtype=np.float32)
+            return
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(rows, self.dimension))
+
+    def _stat(self):
+        try:
+            stat = os.stat(self._records_path)
+            return stat.st_size, stat.st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _maybe_reload(self):
+        # Another process may have written to the store since it was loaded
+        if self._stat() != self._record_stat:
+            self._load()
+
+    @contextmanager
+    def _write_lock(self):
+        with self._lock, open(self._lock_path, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._maybe_reload()
+                yield
+                self._record_stat = self._stat()
+                self._field_indexes = {}
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _compact(self):
+        live_rows = [row for row in range(len(self._ids)) if row not in self._deleted]
+        vectors = np.array(self._vectors[live_rows], dtype=np.float32)
+        records = [{"op": "upsert", "row": new_row, "id": self._ids[row], "metadata": self._metadata[row]}
+                   for new_row, row in enumerate(live_rows)]
+        with open(self._vectors_path + ".tmp", "wb") as f:
+            f.write(vectors.tobytes())
+        with open(self._records_path + ".tmp", "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        os.replace(self._vectors_path + ".tmp", self._vectors_path)
+        os.replace(self._records_path + ".tmp", self._records_path)
+        if os.path.exists(self._centroids_path):
+            os.remove(self._centroids_path)
+        logging.info(f"Compacted local vector store {self.directory} to {len(live_rows)} vectors")
+        self._load()
+
+    # IVF index
+
+    def _assign_lists(self):
+        self._lists = None
+        self._row_lists = {}
+        if self._centroids is None or not len(self._ids):
+            return
+        assignments = np.argmax(np.asarray(self._vectors) @ self._centroids.T, axis=1)
+        self._lists = [set() for _ in range(len(self._centroids))]
+        for row, list_id in enumerate(assignments):
+            if row not in self._deleted:
+                self._add_to_list(row, int(list_id))
+        self._trained_rows = len(self._ids)
+
+    def _add_to_list(self, row: int, list_id: int):
+        self._remove_from_list(row)
+        self._lists[list_id].add(row)
+        self._row_lists[row] = list_id
+
+    def _remove_from_list(self, row: int):
+        list_id = self._row_lists.pop(row, None)
+        if list_id is not None:
+            self._lists[list_id].discard(row)
+
+    def _train_ivf(self):
+        live_rows = np.array([row for row in range(len(self._ids)) if row not in self._deleted])
+        nlist = max(1, int(np.sqrt(len(live_rows))))
+        rng = np.random.default_rng(0)
+        sample = np.asarray(self._vectors[rng.choice(live_rows, size=min(len(live_rows), nlist * 64), replace=False)])
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+        for _ in range(10):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            for list_id in range(nlist):
+                members = sample[assignments == list_id]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[list_id] = centroid / (np.linalg.norm(centroid) or 1.0)
+        self._centroids = centroids.astype(np.float32)
+        with open(self._centroids_path + ".tmp", "wb") as f:
+            np.save(f, self._centroids)
+        os.replace(self._centroids_path + ".tmp", self._centroids_path)
+        self._assign_lists()
+
+    def _ivf_candidates(self, query: np.ndarray) -> np.ndarray:
+        # Retrain once the store has doubled since the index was built
+        live_count = len(self._ids) - len(self._deleted)
+        if self._lists is None or live_count > 2 * self._trained_rows:
+            self._train_ivf()
+        closest = np.argsort(self._centroids @ query)[::-1][:IVF_NPROBE]
+        return np.array([row for list_id in closest for row in self._lists[list_id]], dtype=np.int64)
+
+    # Filters
+
+    def _field_index(self, name: str) -> Dict:
+        index = self._field_indexes.get(name)
+        if index is None:
+            index = {}
+            for row, metadata in enumerate(self._metadata):
+                if row in self._deleted or name not in metadata:
+                    continue
+                value = metadata[name]
+                for item in value if isinstance(value, list) else [value]:
+                    index.setdefault(item, set()).add(row)
+            self._field_indexes[name] = index
+        return index
+
+    def _filter_rows(self, filter: Dict) -> set:
+        live_rows = set(self._rows.values())
+        rows = set(live_rows)
+        for key, condition in filter.items():
+            if key == "$and":
+                for sub_filter in condition:
+                    rows &= self._filter_rows(sub_filter)
+            elif key == "$or":
+                rows &= set().union(*(self._filter_rows(sub_filter) for sub_filter in condition))
+            else:
+                if not isinstance(condition, dict):
+                    condition = {"$eq": condition}
+                index = self._field_index(key)
+                for operator, value in condition.items():
+                    if operator == "$eq":
+                        rows &= index.get(value, set())
+                    elif operator == "$in":
+                        rows &= set().union(*(index.get(item, set()) for item in value))
+                    elif operator == "$ne":
+                        rows -= index.get(value, set())
+                    elif operator == "$nin":
+                        rows -= set().union(*(index.get(item, set()) for item in value))
+                    else:
+                        raise ValueError(f"Unsupported filter operator for the local vector store: {operator}")
+        return rows
+
+    # VectorStore API
+
+    def upsert(self, vectors: List[Dict]):
+        if not vectors:
+            return
+        # An id repeated within the batch keeps its last vector, like successive upserts would
+        vectors = list({vector["id"]: vector for vector in vectors}.values())
+        with self._write_lock():
+            values = np.asarray([vector["values"] for vector in vectors], dtype=np.float32)
+            if values.shape[1] != self.dimension:
+                raise ValueError(f"Vector dimension {values.shape[1]} does not match index dimension {self.dimension}")
+            values /= np.maximum(np.linalg.norm(values, axis=1, keepdims=True), 1e-12)
+
+            records = []
+            appended = []
+            for vector, value in zip(vectors, values):
+                row = self._rows.get(vector["id"])
+                if row is None:
+                    row = len(self._ids) + len(appended)
+                    appended.append(value)
+                    self._rows[vector["id"]] = row
+                else:
+                    self._vectors[row] = value
+                records.append({"op": "upsert", "row": row, "id": vector["id"], "metadata": vector.get("metadata", {})})
+
+            if isinstance(self._vectors, np.memmap):
+                self._vectors.flush()
+            if appended:
+                with open(self._vectors_path, "ab") as f:
+                    f.write(np.asarray(appended, dtype=np.float32).tobytes())
+            with open(self._records_path, "a", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+            for record in records:
+                if record["row"] == len(self._ids):
+                    self._ids.append(record["id"])
+                    self._metadata.append(record["metadata"])
+                else:
+                    self._metadata[record["row"]] = record["metadata"]
+            self._open_vectors()
+            if self._lists is not None:
+                assignments = np.argmax(values @ self._centroids.T, axis=1)
+                for record, list_id in zip(records, assignments):
+                    self._add_to_list(record["row"], int(list_id))
+
+    def delete(self, ids: List[str]):
+        with self._write_lock():
+            deleted = [(vector_id, self._rows.pop(vector_id)) for vector_id in ids if vector_id in self._rows]
+            if not deleted:
+                return
+            with open(self._records_path, "a", encoding="utf-8") as f:
+                for vector_id, _ in deleted:
+                    f.write(json.dumps({"op": "delete", "id": vector_id}) + "\n")
+            for _, row in deleted:
+                self._deleted.add(row)
+                if self._lists is not None:
+                    self._remove_from_list(row)
+            if len(self._deleted) > COMPACT_DELETED_FRACTION * len(self._ids):
+                self._compact()
+
+    def query(self, vector: List[float], top_k: int, filter: Optional[Dict] = None) -> List[VectorMatch]:
+        with self._lock:
+            self._maybe_reload()
+            if not self._rows:
+                return []
+            query = np.asarray(vector, dtype=np.float32)
+            query /= np.linalg.norm(query) or 1.0
+
+            if filter:
+                allowed = self._filter_rows(filter)
+                if len(allowed) > IVF_MIN_VECTORS:
+                    candidates = np.array([row for row in self._ivf_candidates(query) if row in allowed], dtype=np.int64)
+                else:
+                    candidates = np.fromiter(allowed, dtype=np.int64)
+            elif len(self._rows) > IVF_MIN_VECTORS:
+                candidates = self._ivf_candidates(query)
+            else:
+                candidates = np.fromiter(self._rows.values(), dtype=np.int64)
+            if not len(candidates):
+                return []
+
+            scores = np.asarray(self._vectors[candidates]) @ query
+            best = np.argsort(-scores)[:top_k] if len(scores) <= top_k \
+                else np.argpartition(-scores, top_k)[:top_k]
+            best = best[np.argsort(-scores[best])]
+            return [VectorMatch(id=self._ids[candidates[i]], score=float(scores[i]),
+                                metadata=self._metadata[candidates[i]])
+                    for i in best]
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def open_vector_store(index_name: str, dimension: int) -> VectorStore:
+    """
+    Returns the process-wide VectorStore for an index, using the backend selected by
+    VECTOR_STORE_BACKEND. Pinecone indexes are created on first use.
+    """
+    with _stores_lock:
+        store = _stores.get(index_name)
+        if store is not None:
+            return store
+        if VECTOR_STORE_BACKEND == "local":
+            store = LocalVectorStore(os.path.join(LOCAL_VECTOR_STORE_DIR, index_name), dimension)
+        elif VECTOR_STORE_BACKEND == "pinecone":
+            from app.services.pinecone_service import initialize_pinecone, setup_pinecone_index
+            pinecone = initialize_pinecone()
+            setup_pinecone_index(index_name, dimension, pinecone)
+            store = PineconeVectorStore(pinecone.Index(index_name))
+        else:
+            raise ValueError(f"Unknown VECTOR_STORE_BACKEND: {VECTOR_STORE_BACKEND}")
+        _stores[index_name] = store
+        return store
@@ -1,5 +1,4 @@
 # app/utils.py
-import boto3
 from dotenv import load_dotenv
 import os
 import json
@@ -46,7 +45,10 @@ def save_chat_history(document_id: str, history: list):
 
 
 
-embed_model = NVIDIAEmbedding(model="nvidia/nv-embedqa-e5-v5", truncate="END")
+# Number of chunks sent per embedding request when embedding in batches
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+
+embed_model = NVIDIAEmbedding(model="nvidia/nv-embedqa-e5-v5", truncate="END", embed_batch_size=EMBED_BATCH_SIZE)
 # SPDX-FileCopyrightText: Copyright (c) 2023-2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
 # SPDX-License-Identifier: Apache-2.0
 #
@@ -64,24 +66,55 @@ embed_model = NVIDIAEmbedding(model="nvidia/nv-embedqa-e5-v5", truncate="END")
 
 import os
 import base64
+import threading
 import fitz
 from io import BytesIO
 from PIL import Image
-import requests
-from llama_index.llms.nvidia import NVIDIA
-s3_client = boto3.client('s3')
+
+from app.cache import DiskLRUCache, content_hash
+from app.clients import CHART_LLM_MODEL, get_chart_llm, get_http_session, get_s3_client
+
+# Bump when a VLM/LLM prompt below changes so stale descriptions are not served from the cache
+VLM_PROMPT_VERSION = "1"
+VLM_CACHE_DIR = os.getenv("VLM_CACHE_DIR", os.path.join(os.getcwd(), "vectorstore", "vlm_cache"))
+VLM_CACHE_MAX_BYTES = int(os.getenv("VLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+vlm_cache = DiskLRUCache(VLM_CACHE_DIR, max_bytes=VLM_CACHE_MAX_BYTES)
+
+
+# Maximum in-flight requests per NVIDIA endpoint when captioning concurrently
+_endpoint_limits = {
+    "nvidia/neva-22b": threading.BoundedSemaphore(int(os.getenv("NEVA_MAX_CONCURRENCY", "4"))),
+    "google/deplot": threading.BoundedSemaphore(int(os.getenv("DEPLOT_MAX_CONCURRENCY", "4"))),
+    CHART_LLM_MODEL: threading.BoundedSemaphore(int(os.getenv("CHART_LLM_MAX_CONCURRENCY", "8"))),
+}
+
+
+def vlm_cache_key(model_name: str, image_content: bytes) -> str:
+    """Cache key for a model's output on an image: hash of the image bytes, model and prompt version."""
+    return content_hash(model_name, VLM_PROMPT_VERSION, image_content)
 def download_pdf_from_s3(pdf_name: str) -> str:
     temp_dir = "/tmp/"
     # Set a clear, fixed path with UUID for uniqueness
     pdf_path = os.path.join(temp_dir, f"{os.path.basename(pdf_name)}")
     try:
         # Ensure the file downloads to the specified path without suffix
-        s3_client.download_file("cfapublications", pdf_name, pdf_path)
+        get_s3_client().download_file("cfapublications", pdf_name, pdf_path)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error downloading PDF from S3: {str(e)}")
     return pdf_path
 
 
+def get_s3_etag(pdf_name: str) -> str:
+    """
+    Returns the ETag of a PDF stored in S3 without downloading it.
+    """
+    try:
+        response = get_s3_client().head_object(Bucket="cfapublications", Key=pdf_name)
+    except Exception as e:
+        raise HTTPException(status_code=404, detail=f"Document {pdf_name} not found in S3: {str(e)}")
+    return response["ETag"].strip('"')
+
+
 
 def get_b64_image_from_content(image_content):
     """Convert image content to base64 encoded string."""
@@ -95,21 +128,34 @@ def get_b64_image_from_content(image_content):
 
 def is_graph(image_content):
     """Determine if an image is a graph, plot, chart, or table."""
+    # describe_image is cached, so later calls for the same bytes reuse this description
     res = describe_image(image_content)
     return any(keyword in res.lower() for keyword in ["graph", "plot", "chart", "table"])
 
 
 def process_graph(image_content):
     """Process a graph image and generate a description."""
+    cache_key = vlm_cache_key(CHART_LLM_MODEL, image_content)
+    cached = vlm_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     deplot_description = process_graph_deplot(image_content)
-    mixtral = NVIDIA(model_name="meta/llama-3.1-70b-instruct")
-    response = mixtral.complete(
-        "Your responsibility is to explain charts. You are an expert in describing the responses of linearized tables into plain English text for LLMs to use. Explain the following linearized table. " + deplot_description)
+    mixtral = get_chart_llm()
+    with _endpoint_limits[CHART_LLM_MODEL]:
+        response = mixtral.complete(
+            "Your responsibility is to explain charts. You are an expert in describing the responses of linearized tables into plain English text for LLMs to use. Explain the following linearized table. " + deplot_description)
+    vlm_cache.set(cache_key, response.text)
     return response.text
 
 
 def describe_image(image_content):
     """Generate a description of an image using NVIDIA API."""
+    cache_key = vlm_cache_key("nvidia/neva-22b", image_content)
+    cached = vlm_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     image_b64 = get_b64_image_from_content(image_content)
     invoke_url = "https://ai.api.nvidia.com/v1/vlm/nvidia/neva-22b"
     api_key = os.getenv("NVIDIA_API_KEY")
@@ -136,12 +182,20 @@ def describe_image(image_content):
         "stream": False
     }
 
-    response = requests.post(invoke_url, headers=headers, json=payload)
-    return response.json()["choices"][0]['message']['content']
+    with _endpoint_limits["nvidia/neva-22b"]:
+        response = get_http_session().post(invoke_url, headers=headers, json=payload)
+    description = response.json()["choices"][0]['message']['content']
+    vlm_cache.set(cache_key, description)
+    return description
 
 
 def process_graph_deplot(image_content):
     """Process a graph image using NVIDIA's Deplot API."""
+    cache_key = vlm_cache_key("google/deplot", image_content)
+    cached = vlm_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     invoke_url = "https://ai.api.nvidia.com/v1/vlm/google/deplot"
     image_b64 = get_b64_image_from_content(image_content)
     api_key = os.getenv("NVIDIA_API_KEY")
@@ -167,8 +221,11 @@ def process_graph_deplot(image_content):
         "stream": False
     }
 
-    response = requests.post(invoke_url, headers=headers, json=payload)
-    return response.json()["choices"][0]['message']['content']
+    with _endpoint_limits["google/deplot"]:
+        response = get_http_session().post(invoke_url, headers=headers, json=payload)
+    table = response.json()["choices"][0]['message']['content']
+    vlm_cache.set(cache_key, table)
+    return table
 
 
 def extract_text_around_item(text_blocks, bbox, page_height, threshold_percentage=0.1):
@@ -0,0 +1,62 @@
+import pytest
+
+from app.services import answer_cache as answer_cache_module
+from app.services.answer_cache import AnswerCache
+
+
+def test_hit_requires_same_document_chunks_and_normalized_question():
+    cache = AnswerCache()
+    cache.set("doc", ["c2", "c1"], "What is  the Yield?", "4%")
+    assert cache.get("doc", ["c1", "c2"], "what is the yield?") == "4%"
+    assert cache.get("doc", ["c1"], "what is the yield?") is None
+    assert cache.get("other", ["c1", "c2"], "what is the yield?") is None
+    assert cache.get("doc", ["c1", "c2"], "what is the duration?") is None
+
+
+def test_invalidate_drops_only_that_document():
+    cache = AnswerCache(similarity_threshold=0.9)
+    cache.set("doc", ["c1"], "q", "old", question_embedding=[1.0, 0.0])
+    cache.set("other", ["c1"], "q", "kept")
+    cache.invalidate("doc")
+    assert cache.get("doc", ["c1"], "q") is None
+    assert cache.get("doc", ["c1"], "q2", question_embedding=[1.0, 0.0]) is None
+    assert cache.get("other", ["c1"], "q") == "kept"
+
+    cache.set("doc", ["c1"], "q", "new")
+    assert cache.get("doc", ["c1"], "q") == "new"
+
+
+def test_similar_question_reuses_answer_above_threshold():
+    cache = AnswerCache(similarity_threshold=0.95)
+    cache.set("doc", ["c1"], "what is the yield", "4%", question_embedding=[1.0, 0.0, 0.0])
+    assert cache.get("doc", ["c1"], "whats the yield", question_embedding=[0.99, 0.05, 0.0]) == "4%"
+    assert cache.get("doc", ["c1"], "who wrote it", question_embedding=[0.0, 1.0, 0.0]) is None
+    # Only answers built from the same retrieved chunks are reused
+    assert cache.get("doc", ["c2"], "whats the yield", question_embedding=[0.99, 0.05, 0.0]) is None
+
+
+def test_similarity_matching_is_off_without_threshold():
+    cache = AnswerCache()
+    cache.set("doc", ["c1"], "what is the yield", "4%", question_embedding=[1.0, 0.0])
+    assert cache.get("doc", ["c1"], "whats the yield", question_embedding=[1.0, 0.0]) is None
+
+
+def test_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("app.cache.time.monotonic", lambda: now[0])
+    monkeypatch.setattr(answer_cache_module.time, "monotonic", lambda: now[0])
+    cache = AnswerCache(ttl_seconds=60, similarity_threshold=0.9)
+    cache.set("doc", ["c1"], "q", "a", question_embedding=[1.0, 0.0])
+    now[0] += 61
+    assert cache.get("doc", ["c1"], "q") is None
+    assert cache.get("doc", ["c1"], "q2", question_embedding=[1.0, 0.0]) is None
+
+
+def test_stats_count_hits_and_misses():
+    cache = AnswerCache()
+    cache.set("doc", ["c1"], "q", "a")
+    cache.get("doc", ["c1"], "q")
+    cache.get("doc", ["c1"], "other")
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+    assert stats["hit_rate"] == pytest.approx(0.5)
@@ -0,0 +1,88 @@
+import os
+
+import pytest
+
+from app.cache import DiskLRUCache, LRUCache
+
+
+def entry_size(cache, key):
+    return os.path.getsize(cache._path(key))
+
+
+def age(cache, key, seconds):
+    # Back-dates an entry so eviction order does not depend on the filesystem's mtime resolution
+    stat = os.stat(cache._path(key))
+    os.utime(cache._path(key), (stat.st_atime - seconds, stat.st_mtime - seconds))
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_round_trip(tmp_path, compress):
+    cache = DiskLRUCache(str(tmp_path), max_bytes=1024 * 1024, compress=compress)
+    value = {"pages": [{"page": 1, "md": "Yield rose to 4%"}], "note": "Zürich"}
+    cache.set("ab" * 32, value)
+    assert cache.get("ab" * 32) == value
+    assert "ab" * 32 in cache
+
+    cache.delete("ab" * 32)
+    assert "ab" * 32 not in cache
+    assert cache.get("ab" * 32, "missing") == "missing"
+
+
+def test_overwrite_counts_only_the_size_difference(tmp_path):
+    cache = DiskLRUCache(str(tmp_path), max_bytes=1024 * 1024)
+    for text in ["x" * 100, "x" * 400, "x" * 50]:
+        cache.set("aa" * 32, text)
+    assert cache._total_bytes == entry_size(cache, "aa" * 32)
+
+
+def test_evicts_least_recently_used_entries_past_the_byte_budget(tmp_path):
+    cache = DiskLRUCache(str(tmp_path), max_bytes=1100)
+    keys = [f"{n:02d}" * 32 for n in range(3)]
+    for n, key in enumerate(keys):
+        cache.set(key, "x" * 300)
+        age(cache, key, 100 - n)
+    # Reading the oldest entry makes it the most recently used one
+    assert cache.get(keys[0]) == "x" * 300
+
+    cache.set("99" * 32, "x" * 300)
+    assert keys[1] not in cache
+    assert keys[0] in cache and keys[2] in cache and "99" * 32 in cache
+    assert cache._total_bytes <= 1100 * 0.9
+    assert cache._total_bytes == sum(entry_size(cache, key) for key in [keys[0], keys[2], "99" * 32])
+
+
+def test_reload_counts_the_entries_already_on_disk(tmp_path):
+    cache = DiskLRUCache(str(tmp_path), max_bytes=1024 * 1024, compress=True)
+    cache.set("aa" * 32, ["a"] * 100)
+    cache.set("bb" * 32, ["b"] * 200)
+
+    reloaded = DiskLRUCache(str(tmp_path), max_bytes=1024 * 1024, compress=True)
+    assert reloaded._total_bytes == cache._total_bytes
+    assert reloaded.get("bb" * 32) == ["b"] * 200
+
+
+def test_unreadable_entries_are_dropped(tmp_path):
+    cache = DiskLRUCache(str(tmp_path), max_bytes=1024 * 1024)
+    cache.set("aa" * 32, {"ok": True})
+    with open(cache._path("aa" * 32), "w") as f:
+        f.write("{truncated")
+
+    assert cache.get("aa" * 32) is None
+    assert "aa" * 32 not in cache
+
+
+def test_lru_cache_evicts_oldest_and_expires_entries(monkeypatch):
+    cache = LRUCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.stats() == {"entries": 2, "hits": 1, "misses": 1, "hit_rate": 0.5}
+
+    now = [1000.0]
+    monkeypatch.setattr("app.cache.time.monotonic", lambda: now[0])
+    expiring = LRUCache(max_entries=2, ttl_seconds=10)
+    expiring.set("a", 1)
+    now[0] += 11
+    assert expiring.get("a") is None
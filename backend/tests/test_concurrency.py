@@ -0,0 +1,60 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app import concurrency
+
+
+@pytest.fixture(autouse=True)
+def pools(monkeypatch):
+    monkeypatch.setattr(concurrency, "POOL_SIZES", {"chat": 4, "report": 1})
+    yield
+    concurrency.shutdown_pools()
+
+
+def test_run_in_pool_runs_on_the_named_pool():
+    name = asyncio.run(concurrency.run_in_pool("chat", lambda: threading.current_thread().name))
+    assert name.startswith("chat-worker")
+
+
+def test_pool_size_bounds_concurrency_without_blocking_the_loop():
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def work():
+        with lock:
+            active.append(1)
+            peak.append(len(active))
+        time.sleep(0.05)
+        with lock:
+            active.pop()
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        ticking = asyncio.create_task(ticker())
+        await asyncio.gather(*(concurrency.run_in_pool("report", work) for _ in range(3)))
+        ticking.cancel()
+        return ticks
+
+    ticks = asyncio.run(main())
+    assert max(peak) == 1
+    # The event loop kept running while the blocking calls were queued on the pool
+    assert ticks > 5
+
+
+def test_exceptions_propagate():
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        asyncio.run(concurrency.run_in_pool("chat", fail))
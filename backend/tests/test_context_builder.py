@@ -0,0 +1,78 @@
+import pytest
+
+from app.services import context_builder
+from app.services.context_builder import build_context
+from app.services.vector_store import VectorMatch
+
+
+class WordEncoding:
+    """Stand-in for a tiktoken encoding with one token per whitespace-separated word."""
+
+    def __init__(self):
+        self.words = []
+
+    def encode(self, text):
+        tokens = []
+        for word in text.split(" "):
+            if word not in self.words:
+                self.words.append(word)
+            tokens.append(self.words.index(word))
+        return tokens
+
+    def decode(self, tokens):
+        return " ".join(self.words[token] for token in tokens)
+
+
+@pytest.fixture(autouse=True)
+def word_encoding(monkeypatch):
+    monkeypatch.setattr(context_builder, "get_encoding", lambda model=None: WordEncoding())
+    monkeypatch.setattr(context_builder, "CONTEXT_MIN_CHUNK_TOKENS", 3)
+
+
+def match(vector_id, text, document_id="doc", page_num=1):
+    return VectorMatch(vector_id, 1.0, {"text": text, "document_id": document_id, "page_num": page_num})
+
+
+def words(prefix, count):
+    return " ".join(f"{prefix}{i}" for i in range(count))
+
+
+def test_keeps_everything_within_budget_in_document_and_page_order():
+    context = build_context([
+        match("a", words("late", 5), page_num=7),
+        match("b", words("early", 5), page_num=2),
+        match("c", words("other", 5), document_id="another", page_num=1),
+    ], token_budget=100)
+    assert context.text.split("\n\n") == [words("other", 5), words("early", 5), words("late", 5)]
+    assert (context.chunks, context.duplicates, context.truncated) == (3, 0, 0)
+    assert context.tokens == 15 + 2 * len(WordEncoding().encode("\n\n"))
+
+
+def test_drops_near_duplicate_chunks():
+    text = words("w", 30)
+    context = build_context([
+        match("a", text, page_num=1),
+        match("b", text.replace("w29", "changed"), page_num=2),
+        match("c", words("x", 10), page_num=3),
+    ], token_budget=1000)
+    assert (context.chunks, context.duplicates) == (2, 1)
+    assert "changed" not in context.text
+
+
+def test_truncates_the_last_chunk_to_fit_the_budget():
+    context = build_context([match("a", words("a", 10), page_num=1), match("b", words("b", 10), page_num=2)],
+                            token_budget=16)
+    assert context.tokens == 16
+    assert (context.chunks, context.truncated) == (2, 1)
+    assert context.text.endswith(words("b", 5))
+
+
+def test_stops_when_too_little_budget_is_left():
+    context = build_context([match("a", words("a", 10)), match("b", words("b", 10), page_num=2)], token_budget=12)
+    assert (context.chunks, context.truncated) == (1, 0)
+    assert context.text == words("a", 10)
+
+
+def test_skips_empty_chunks():
+    context = build_context([match("a", "   "), match("b", words("b", 4))], token_budget=100)
+    assert (context.chunks, context.text) == (1, words("b", 4))
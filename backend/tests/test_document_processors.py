@@ -0,0 +1,46 @@
+import io
+
+import pymupdf as fitz
+import pytest
+
+from app import document_processors
+
+
+@pytest.fixture
+def pdf_path(tmp_path):
+    doc = fitz.open()
+    for n in range(5):
+        doc.new_page().insert_text((72, 200), f"Heading {n}\nBody text of page {n}")
+    path = tmp_path / "report.pdf"
+    doc.save(str(path))
+    return path
+
+
+def extract(pdf_path, parallel):
+    with open(pdf_path, "rb") as pdf_file:
+        return [(doc.doc_id, doc.text, doc.metadata) for doc in
+                document_processors.get_pdf_documents(pdf_file, parallel=parallel)]
+
+
+def test_parallel_extraction_matches_sequential_and_reuses_the_pool(pdf_path):
+    try:
+        sequential = extract(pdf_path, parallel=False)
+        assert [metadata["page_num"] for _, _, metadata in sequential] == [0, 1, 2, 3, 4]
+        assert extract(pdf_path, parallel=True) == sequential
+
+        pool = document_processors.get_extract_pool()
+        assert extract(pdf_path, parallel=True) == sequential
+        assert document_processors.get_extract_pool() is pool
+    finally:
+        document_processors.shutdown_extract_pool()
+    assert document_processors._extract_pool is None
+
+
+def test_unreadable_pdf():
+    pdf_file = io.BytesIO(b"not a pdf")
+    pdf_file.name = "broken.pdf"
+    assert document_processors.get_pdf_documents(pdf_file) == []
+
+    pdf_file.seek(0)
+    with pytest.raises(Exception):
+        list(document_processors.iter_pdf_documents(pdf_file))
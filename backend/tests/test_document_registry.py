@@ -0,0 +1,68 @@
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from app.services import document_registry, manifest_store
+
+
+@pytest.fixture(autouse=True)
+def manifest_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(manifest_store, "MANIFEST_DB_PATH", str(tmp_path / "manifest.db"))
+    monkeypatch.setattr(document_registry, "INGEST_POLL_SECONDS", 0.01)
+    manifest_store._local.conn = None
+    yield
+    manifest_store.get_connection().close()
+    manifest_store._local.conn = None
+
+
+def ingest_owner(document_id):
+    row = manifest_store.get_connection().execute(
+        "SELECT ingest_owner, ingesting_etag FROM documents WHERE document_id = ?", (document_id,)
+    ).fetchone()
+    return tuple(row) if row else None
+
+
+def test_ingest_lock_claims_and_releases_the_document():
+    with document_registry.ingest_lock("doc", "etag-1"):
+        assert ingest_owner("doc") == (document_registry.WORKER_ID, "etag-1")
+    assert ingest_owner("doc") == (None, None)
+
+
+def test_ingest_lock_releases_the_claim_on_failure():
+    with pytest.raises(RuntimeError):
+        with document_registry.ingest_lock("doc", "etag-1"):
+            raise RuntimeError("parse failed")
+    assert ingest_owner("doc") == (None, None)
+    with document_registry.ingest_lock("doc", "etag-1", timeout=0.1):
+        pass
+
+
+def test_ingest_lock_gives_up_while_another_worker_holds_the_claim():
+    assert manifest_store.claim_ingest("doc", "etag-1", "other-worker")
+    with pytest.raises(HTTPException) as error:
+        with document_registry.ingest_lock("doc", "etag-1", timeout=0.05):
+            pytest.fail("claimed a document held by another worker")
+    assert error.value.status_code == 503
+    assert ingest_owner("doc") == ("other-worker", "etag-1")
+
+
+def test_ingest_lock_gives_up_while_another_thread_ingests():
+    entered, release = threading.Event(), threading.Event()
+
+    def ingest():
+        with document_registry.ingest_lock("doc", "etag-1"):
+            entered.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=ingest)
+    thread.start()
+    try:
+        assert entered.wait(5)
+        with pytest.raises(HTTPException) as error:
+            with document_registry.ingest_lock("doc", "etag-1", timeout=0.05):
+                pytest.fail("entered a document another thread is ingesting")
+        assert error.value.status_code == 503
+    finally:
+        release.set()
+        thread.join(5)
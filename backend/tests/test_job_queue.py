@@ -0,0 +1,104 @@
+import pytest
+
+from app.services import job_queue
+
+
+def double(params, progress):
+    progress(0.5, "halfway")
+    return {"value": params["value"] * 2}
+
+
+def explode(params, progress):
+    raise RuntimeError("boom")
+
+
+@pytest.fixture(autouse=True)
+def jobs_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_queue, "JOBS_DB_PATH", str(tmp_path / "jobs.db"))
+    monkeypatch.setattr(job_queue, "HANDLERS", {"double": f"{__name__}:double", "explode": f"{__name__}:explode"})
+    job_queue._local.conn = None
+    yield
+    job_queue.get_connection().close()
+    job_queue._local.conn = None
+
+
+def test_enqueue_returns_the_in_flight_job_for_identical_params():
+    job, created = job_queue.enqueue("double", {"value": 2})
+    assert created and job["status"] == job_queue.QUEUED and job["params"] == {"value": 2}
+
+    same, created = job_queue.enqueue("double", {"value": 2})
+    assert not created and same["job_id"] == job["job_id"]
+
+    other, created = job_queue.enqueue("double", {"value": 3})
+    assert created and other["job_id"] != job["job_id"]
+
+
+def test_enqueue_queues_again_once_the_job_finished():
+    job, _ = job_queue.enqueue("double", {"value": 2})
+    job_queue.finish(job_queue.claim_next("w1")["job_id"], "w1", result={"value": 4})
+
+    again, created = job_queue.enqueue("double", {"value": 2})
+    assert created and again["job_id"] != job["job_id"]
+
+
+def test_enqueue_rejects_unknown_kinds():
+    with pytest.raises(ValueError):
+        job_queue.enqueue("missing", {})
+
+
+def test_claim_next_hands_out_the_oldest_job_once():
+    first, _ = job_queue.enqueue("double", {"value": 1})
+    second, _ = job_queue.enqueue("double", {"value": 2})
+
+    claimed = job_queue.claim_next("w1")
+    assert claimed["job_id"] == first["job_id"]
+    assert claimed["status"] == job_queue.RUNNING and claimed["worker"] == "w1"
+    assert job_queue.claim_next("w2")["job_id"] == second["job_id"]
+    assert job_queue.claim_next("w3") is None
+
+
+def test_only_the_owning_worker_updates_a_job():
+    job, _ = job_queue.enqueue("double", {"value": 1})
+    job_queue.claim_next("w1")
+
+    job_queue.update_progress(job["job_id"], "w2", 0.9, "not mine")
+    job_queue.finish(job["job_id"], "w2", error="not mine")
+    assert job_queue.get_job(job["job_id"])["status"] == job_queue.RUNNING
+    assert job_queue.get_job(job["job_id"])["progress"] == 0
+
+    job_queue.update_progress(job["job_id"], "w1", 0.5, "halfway")
+    job = job_queue.get_job(job["job_id"])
+    assert (job["progress"], job["message"]) == (0.5, "halfway")
+
+
+def test_expired_leases_are_handed_to_another_worker(monkeypatch):
+    job, _ = job_queue.enqueue("double", {"value": 1})
+    job_queue.claim_next("w1")
+    assert job_queue.claim_next("w2") is None
+
+    monkeypatch.setattr(job_queue, "JOB_LEASE_SECONDS", -1)
+    reclaimed = job_queue.claim_next("w2")
+    assert reclaimed["job_id"] == job["job_id"] and reclaimed["worker"] == "w2"
+
+    # The first worker lost the job, so its late result is ignored
+    job_queue.finish(job["job_id"], "w1", result={"value": 0})
+    assert job_queue.get_job(job["job_id"])["status"] == job_queue.RUNNING
+
+
+def test_run_job_records_the_result():
+    job, _ = job_queue.enqueue("double", {"value": 21})
+    job_queue.run_job(job_queue.claim_next("w1"), "w1")
+
+    job = job_queue.get_job(job["job_id"])
+    assert job["status"] == job_queue.SUCCEEDED
+    assert job["result"] == {"value": 42}
+    assert (job["progress"], job["message"], job["error"]) == (1, "halfway", None)
+
+
+def test_run_job_records_the_error():
+    job, _ = job_queue.enqueue("explode", {})
+    job_queue.run_job(job_queue.claim_next("w1"), "w1")
+
+    job = job_queue.get_job(job["job_id"])
+    assert job["status"] == job_queue.FAILED
+    assert job["error"] == "boom" and job["result"] is None
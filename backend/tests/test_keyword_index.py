@@ -0,0 +1,80 @@
+import math
+
+import pytest
+
+from app.services import keyword_index
+
+
+@pytest.fixture
+def index_name(tmp_path, monkeypatch):
+    monkeypatch.setattr(keyword_index, "KEYWORD_INDEX_DIR", str(tmp_path))
+    # Connections are cached per thread and index name, so every test uses its own name
+    return f"test-{tmp_path.name}"
+
+
+def df(index_name, term):
+    row = keyword_index.get_connection(index_name).execute("SELECT df FROM terms WHERE term = ?", (term,)).fetchone()
+    return row[0] if row else 0
+
+
+def stats(index_name):
+    return dict(keyword_index.get_connection(index_name).execute("SELECT name, value FROM stats"))
+
+
+def test_tokenize_keeps_figures_and_drops_stopwords():
+    assert keyword_index.tokenize("The S&P 500 rose 3.5% to 1,200 in Q4") == ["s&p", "500", "rose", "3.5%", "1,200", "q4"]
+
+
+def test_search_ranks_with_bm25(index_name):
+    keyword_index.add_chunks(index_name, "doc", [
+        ("v1", 1, "inflation inflation expectations"),
+        ("v2", 2, "equity returns and inflation"),
+        ("v3", 3, "bond duration"),
+    ])
+    matches = keyword_index.search(index_name, "inflation", ["doc"], top_k=5)
+    assert [match.id for match in matches] == ["v1", "v2"]
+    assert matches[0].metadata == {"text": "inflation inflation expectations", "page_num": 1, "document_id": "doc"}
+
+    # idf of a term in 2 of 3 chunks, tf 2, chunk length 3 against an average of 8/3
+    idf = math.log(1 + (3 - 2 + 0.5) / (2 + 0.5))
+    norm = keyword_index.BM25_K1 * (1 - keyword_index.BM25_B + keyword_index.BM25_B * 3 / (8 / 3))
+    assert matches[0].score == pytest.approx(idf * 2 * (keyword_index.BM25_K1 + 1) / (2 + norm))
+
+
+def test_search_is_scoped_to_documents(index_name):
+    keyword_index.add_chunks(index_name, "a", [("a1", 1, "credit spreads")])
+    keyword_index.add_chunks(index_name, "b", [("b1", 1, "credit risk")])
+    assert [match.id for match in keyword_index.search(index_name, "credit", ["b"], top_k=5)] == ["b1"]
+    assert keyword_index.search(index_name, "credit", ["missing"], top_k=5) == []
+    assert keyword_index.search(index_name, "the and of", ["a", "b"], top_k=5) == []
+
+
+def test_replacing_and_deleting_chunks_keeps_df_and_stats_consistent(index_name):
+    keyword_index.add_chunks(index_name, "doc", [("v1", 1, "alpha beta"), ("v2", 2, "alpha gamma")])
+    assert (df(index_name, "alpha"), df(index_name, "beta")) == (2, 1)
+    assert stats(index_name) == {"chunk_count": 2, "total_length": 4}
+
+    # Re-adding a vector ID replaces the chunk
+    keyword_index.add_chunks(index_name, "doc", [("v1", 1, "delta delta delta")])
+    assert (df(index_name, "alpha"), df(index_name, "beta"), df(index_name, "delta")) == (1, 0, 1)
+    assert stats(index_name) == {"chunk_count": 2, "total_length": 5}
+    assert [match.id for match in keyword_index.search(index_name, "beta", ["doc"], top_k=5)] == []
+
+    keyword_index.delete_chunks(index_name, ["v2", "unknown"])
+    assert df(index_name, "alpha") == 0
+    assert stats(index_name) == {"chunk_count": 1, "total_length": 3}
+    assert keyword_index.indexed_vector_ids(index_name, "doc") == {"v1"}
+    assert keyword_index.search(index_name, "alpha", ["doc"], top_k=5) == []
+
+
+def test_failed_add_rolls_back(index_name, monkeypatch):
+    keyword_index.add_chunks(index_name, "doc", [("v1", 1, "alpha")])
+
+    def failing_tokenize(text):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(keyword_index, "tokenize", failing_tokenize)
+    with pytest.raises(RuntimeError):
+        keyword_index.add_chunks(index_name, "doc", [("v1", 1, "beta")])
+    assert keyword_index.indexed_vector_ids(index_name, "doc") == {"v1"}
+    assert stats(index_name) == {"chunk_count": 1, "total_length": 1}
@@ -0,0 +1,116 @@
+import numpy as np
+import pytest
+
+from app.services import vector_store
+from app.services.vector_store import LocalVectorStore
+
+
+def unit(dimension, axis):
+    values = [0.0] * dimension
+    values[axis] = 1.0
+    return values
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalVectorStore(str(tmp_path / "index"), 4)
+
+
+def test_query_ranks_by_cosine_similarity(store):
+    store.upsert([
+        {"id": "a", "values": [1, 0, 0, 0], "metadata": {"document_id": "d1"}},
+        {"id": "b", "values": [1, 1, 0, 0], "metadata": {"document_id": "d2"}},
+        {"id": "c", "values": [0, 0, 1, 0], "metadata": {"document_id": "d1"}},
+    ])
+    matches = store.query([1, 0, 0, 0], top_k=2)
+    assert [match.id for match in matches] == ["a", "b"]
+    assert matches[0].score == pytest.approx(1.0)
+    assert matches[0].metadata == {"document_id": "d1"}
+
+
+def test_filters(store):
+    store.upsert([
+        {"id": f"v{i}", "values": unit(4, i % 4), "metadata": {"document_id": f"d{i % 3}", "page_num": i}}
+        for i in range(9)
+    ])
+    ids = lambda filter: {match.id for match in store.query([1, 1, 1, 1], top_k=9, filter=filter)}
+    assert ids({"document_id": {"$eq": "d1"}}) == {"v1", "v4", "v7"}
+    assert ids({"document_id": {"$in": ["d0", "d2"]}}) == {"v0", "v2", "v3", "v5", "v6", "v8"}
+    assert ids({"$and": [{"document_id": "d0"}, {"page_num": {"$ne": 3}}]}) == {"v0", "v6"}
+    assert ids({"$or": [{"page_num": 1}, {"page_num": {"$in": [2, 8]}}]}) == {"v1", "v2", "v8"}
+    with pytest.raises(ValueError):
+        ids({"page_num": {"$gt": 1}})
+
+
+def test_upsert_overwrites_existing_id(store):
+    store.upsert([{"id": "a", "values": [1, 0, 0, 0], "metadata": {"version": 1}}])
+    store.upsert([{"id": "a", "values": [0, 1, 0, 0], "metadata": {"version": 2}}])
+    matches = store.query([0, 1, 0, 0], top_k=5)
+    assert [(match.id, match.metadata["version"]) for match in matches] == [("a", 2)]
+    assert matches[0].score == pytest.approx(1.0)
+
+
+def test_duplicate_ids_in_one_batch_keep_the_last_vector(store, tmp_path):
+    store.upsert([
+        {"id": "a", "values": [1, 0, 0, 0], "metadata": {"version": 1}},
+        {"id": "b", "values": [0, 0, 1, 0], "metadata": {}},
+        {"id": "a", "values": [0, 1, 0, 0], "metadata": {"version": 2}},
+    ])
+    store.upsert([{"id": "c", "values": [0, 0, 0, 1], "metadata": {}}])
+    for current in (store, LocalVectorStore(str(tmp_path / "index"), 4)):
+        matches = current.query([0, 1, 0, 0], top_k=5)
+        assert len(matches) == 3
+        assert (matches[0].id, matches[0].metadata) == ("a", {"version": 2})
+
+
+def test_delete_and_compaction_survive_reload(store, tmp_path):
+    store.upsert([{"id": f"v{i}", "values": unit(4, i % 4), "metadata": {"i": i}} for i in range(8)])
+    store.delete(["v0", "missing"])
+    assert "v0" not in {match.id for match in store.query([1, 0, 0, 0], top_k=8)}
+
+    # Deleting more than COMPACT_DELETED_FRACTION of the rows rewrites the files
+    store.delete(["v1", "v2"])
+    assert len(store._ids) == 5
+
+    reloaded = LocalVectorStore(str(tmp_path / "index"), 4)
+    assert {match.id for match in reloaded.query([1, 1, 1, 1], top_k=8)} == {"v3", "v4", "v5", "v6", "v7"}
+    match = reloaded.query([1, 0, 0, 0], top_k=1)[0]
+    assert (match.id, match.metadata) == ("v4", {"i": 4})
+
+
+def test_writes_from_another_instance_are_picked_up(store, tmp_path):
+    other = LocalVectorStore(str(tmp_path / "index"), 4)
+    other.upsert([{"id": "a", "values": [1, 0, 0, 0], "metadata": {}}])
+    assert [match.id for match in store.query([1, 0, 0, 0], top_k=1)] == ["a"]
+
+
+def test_ivf_index_finds_nearest_neighbours(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_store, "IVF_MIN_VECTORS", 100)
+    monkeypatch.setattr(vector_store, "IVF_NPROBE", 4)
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=(2000, 16)).astype(np.float32)
+    store = LocalVectorStore(str(tmp_path / "ivf"), 16)
+    store.upsert([{"id": f"v{i}", "values": values[i].tolist(), "metadata": {"doc": f"d{i % 5}"}}
+                  for i in range(len(values))])
+
+    for i in (3, 512, 1999):
+        assert store.query((values[i] + 0.01).tolist(), top_k=1)[0].id == f"v{i}"
+    assert store._lists is not None
+
+    # Vectors added after training go into the existing lists
+    store.upsert([{"id": "new", "values": values[7].tolist(), "metadata": {"doc": "d9"}}])
+    assert {match.id for match in store.query(values[7].tolist(), top_k=2)} == {"v7", "new"}
+
+
+def test_dimension_mismatch_is_rejected(store):
+    with pytest.raises(ValueError):
+        store.upsert([{"id": "a", "values": [1, 0], "metadata": {}}])
+
+
+def test_backends_must_implement_the_whole_interface():
+    class UpsertOnly(vector_store.VectorStore):
+        def upsert(self, vectors):
+            pass
+
+    with pytest.raises(TypeError):
+        UpsertOnly()
@@ -0,0 +1,91 @@
+"""
+Concurrent load benchmark for the FastAPI backend.
+
+Fires a fixed number of identical requests at an endpoint from a pool of client threads and
+reports throughput and latency percentiles for each concurrency level, e.g.:
+
+    python scripts/load_benchmark.py --url http://localhost:8000 --token $TOKEN \
+        --document-id assignment3/pdfs/report.pdf --concurrency 1 8 32 --requests 64
+
+Run it against a build before and after a change to compare concurrent throughput. Use distinct
+messages (--unique-messages) to bypass the answer cache.
+"""
+import argparse
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def build_request(args, n: int):
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+    message = args.message
+    if args.unique_messages:
+        message = f"{message} ({n}-{uuid.uuid4().hex[:6]})"
+    if args.endpoint == "chat":
+        return "POST", "/chat", headers, {"document_id": args.document_id, "message": message}
+    if args.endpoint == "summarize":
+        return "POST", "/summarize", headers, {"document_name": args.document_id}
+    if args.endpoint == "publications":
+        return "GET", "/publications", headers, None
+    return "GET", "/health", headers, None
+
+
+def run_level(args, concurrency: int) -> dict:
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    def send(n: int):
+        method, path, headers, body = build_request(args, n)
+        started = time.perf_counter()
+        try:
+            response = session.request(method, args.url.rstrip("/") + path, headers=headers, json=body,
+                                       timeout=args.timeout)
+            ok = response.status_code < 400
+        except requests.RequestException:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": sum(1 for _, ok in results if not ok),
+        "throughput": len(results) / elapsed,
+        "p50": statistics.median(latencies),
+        "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "max": latencies[-1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent load benchmark for the backend API.")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--token", help="JWT access token")
+    parser.add_argument("--endpoint", choices=["chat", "summarize", "publications", "health"], default="chat")
+    parser.add_argument("--document-id", default="")
+    parser.add_argument("--message", default="What are the key findings of this document?")
+    parser.add_argument("--unique-messages", action="store_true", help="Vary the message to avoid cache hits")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=64, help="Requests per concurrency level")
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    print(f"{'concurrency':>11} {'requests':>8} {'errors':>6} {'req/s':>8} {'p50 s':>8} {'p95 s':>8} {'max s':>8}")
+    for concurrency in args.concurrency:
+        r = run_level(args, concurrency)
+        print(f"{r['concurrency']:>11} {r['requests']:>8} {r['errors']:>6} {r['throughput']:>8.2f} "
+              f"{r['p50']:>8.3f} {r['p95']:>8.3f} {r['max']:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()